@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""Script for benchmarking the spider against a local fake of the GitHub API."""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from loader.fake import FakeGitHub, FakeGraph
+from loader.github import GitHub, BATCH_SIZE
+from loader.planner import Planner
+from loader.spider import Spider, WRITE_BATCH_SIZE
+from loader.storage import Storage, SqliteStorage
+
+SEED = 'https://github.com/tensorflow/tensorflow'
+REPOSITORY = 'repository'
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class CountingStorage(Storage):
+    """Storage counting the writes and processed nodes of the storage it wraps."""
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+        self.writes = 0
+        self.relatives = 0
+        self.processed = 0
+
+    def merge_node(self, label, uri, properties):
+        self.writes += 1
+        return self.storage.merge_node(label, uri, properties)
+
+    def merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge):
+        self.writes += 1
+        self.relatives += len(relatives)
+        return self.storage.merge_relatives(parent_id, relatives, label, edge_label, reverse_edge)
+
+    def mark_processed(self, node_id):
+        self.writes += 1
+        self.processed += 1
+        return self.storage.mark_processed(node_id)
+
+    def mark_error(self, node_id, error, trace):
+        self.writes += 1
+        return self.storage.mark_error(node_id, error, trace)
+
+    def node_id(self, uri):
+        return self.storage.node_id(uri)
+
+    def node(self, node_id):
+        return self.storage.node(node_id)
+
+    def count(self):
+        return self.storage.count()
+
+    def count_unprocessed(self, before, skip_errors=False):
+        return self.storage.count_unprocessed(before, skip_errors)
+
+    def has_unprocessed(self, skip_errors=False):
+        return self.storage.has_unprocessed(skip_errors)
+
+    def unprocessed(self, before, repos_first=True, skip_errors=False):
+        return self.storage.unprocessed(before, repos_first, skip_errors)
+
+    def unprocessed_nodes(self):
+        return self.storage.unprocessed_nodes()
+
+    def close(self):
+        self.storage.close()
+
+
+class TimedGitHub(GitHub):
+    """GitHub client recording the latency of every query by the connections it fetches."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = {}
+
+    def _record(self, connections, latency):
+        for connection in set(connections):
+            self.latencies.setdefault(connection, []).append(latency)
+
+    def _post_batch(self, batch):
+        start = time.time()
+        data = super()._post_batch(batch)
+        self._record([connection for _, connection, _ in batch], time.time() - start)
+        return data
+
+    def get_repository(self, id_or_url):
+        start = time.time()
+        repository = super().get_repository(id_or_url)
+        self._record([REPOSITORY], time.time() - start)
+        return repository
+
+
+def benchmark(args, storage_path):
+    graph = FakeGraph(args.repositories, args.users, args.languages, args.fan_out)
+    server = FakeGitHub(graph, latency=args.latency, latency_per_item=args.latency_per_item,
+                        error_rate=args.error_rate, max_items=args.max_items, rate_limit=args.rate_limit).start()
+    try:
+        planner = Planner() if args.adaptive_pages else None
+        github = TimedGitHub(['fake-{}'.format(n) for n in range(args.tokens)], server.url,
+                             pool_size=args.concurrency, quiet=True, planner=planner)
+        storage = CountingStorage(SqliteStorage(storage_path))
+        spider = Spider(storage, github, args.relatives_cap, args.max_property_size, args.batch_size,
+                        args.write_batch_size, pull_requests=args.pull_requests)
+
+        start = time.time()
+        spider.load_repository(SEED)
+        # merged relatives are due again, so the crawl ends with the first iteration which finds no new node
+        known = 0
+        while storage.count() > known and spider.has_unprocessed(skip_errors=True):
+            known = storage.count()
+            if args.concurrency > 1:
+                spider.process_async(args.concurrency, quiet=True)
+            else:
+                spider.process(quiet=True)
+        elapsed = time.time() - start
+    finally:
+        server.stop()
+
+    nodes = max(1, storage.processed)
+    return {
+        'nodes': storage.processed,
+        'seconds': elapsed,
+        'nodes_per_second': storage.processed / elapsed,
+        'requests': server.requests,
+        'errors': server.errors,
+        'requests_per_node': server.requests / nodes,
+        'writes_per_node': storage.writes / nodes,
+        'relatives_per_node': storage.relatives / nodes,
+        'stages': github.metrics.totals(),
+        'latency': {connection: {'count': len(latencies), 'p50': _percentile(latencies, 0.5),
+                                 'p99': _percentile(latencies, 0.99)}
+                    for connection, latencies in sorted(github.latencies.items())},
+    }
+
+
+def _print(report):
+    print('{nodes} nodes in {seconds:.1f} s: {nodes_per_second:.1f} nodes/s, {requests_per_node:.2f} requests/node, '
+          '{writes_per_node:.2f} writes/node, {relatives_per_node:.2f} relatives/node, {errors} errors'
+          .format(**report))
+    print('{:<36} {:>8} {:>10} {:>10}'.format('connection', 'queries', 'p50 [ms]', 'p99 [ms]'))
+    for connection, latency in report['latency'].items():
+        print('{:<36} {:>8} {:>10.1f} {:>10.1f}'.format(connection, latency['count'], latency['p50'] * 1000,
+                                                          latency['p99'] * 1000))
+
+
+def main(args):
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger('backoff').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = benchmark(args, args.storage or os.path.join(directory, 'graph.sqlite'))
+
+    _print(report)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repositories', type=int, default=100,
+                        help="Number of repositories of the fake graph.")
+    parser.add_argument('--users', type=int, default=1000,
+                        help="Number of users of the fake graph.")
+    parser.add_argument('--languages', type=int, default=20,
+                        help="Number of languages of the fake graph.")
+    parser.add_argument('--fan-out', type=int, default=10,
+                        help="Average number of items of every connection.")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds every fake API request takes.")
+    parser.add_argument('--latency-per-item', type=float, default=0.0,
+                        help="Additional seconds per requested item.")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Probability of a fake API request failing with a 502.")
+    parser.add_argument('--max-items', type=int, default=None,
+                        help="Requests asking for more items fail with a 502.")
+    parser.add_argument('--rate-limit', type=int, default=5000,
+                        help="Rate limit points per token and hour.")
+    parser.add_argument('--tokens', type=int, default=1,
+                        help="Number of fake tokens.")
+    parser.add_argument('--storage', type=str, default=None,
+                        help="SQLite file to crawl into, a temporary one by default.")
+    parser.add_argument('--relatives-cap', type=int, default=10000)
+    parser.add_argument('--max-property-size', type=int, default=65534)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--write-batch-size', type=int, default=WRITE_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--adaptive-pages', action='store_true')
+    parser.add_argument('--pull-requests', action='store_true')
+    parser.add_argument('--output', type=str, default=None,
+                        help="JSON file to write the report into, to compare later runs against.")
+    main(parser.parse_args())
@@ -4,50 +4,240 @@
 
 import argparse
 import logging
+import multiprocessing
+from multiprocessing.connection import wait
 
 from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.structure.graph import Graph
 
-from loader.github import GitHub
-from loader.spider import Spider
+from loader.cache import ResponseCache
+from loader.frontier import Frontier, LEASE_TTL
+from loader.github import GitHub, BATCH_SIZE, POOL_SIZE
+from loader.idcache import IdCache, PersistentIdCache, ID_CACHE_SIZE
+from loader.journal import Journal
+from loader.metrics import Metrics, SNAPSHOT_INTERVAL
+from loader.planner import Planner, TARGET_COST, TARGET_LATENCY
+from loader.scheduler import SCHEDULERS
+from loader.spider import Spider, WRITE_BATCH_SIZE
+from loader.storage import GremlinStorage, SqliteStorage
+from loader.tokens import RESERVE
 
 DB_URL = 'ws://localhost:8182/gremlin'
+PROGRESS_INTERVAL = 60.0
+POLL_INTERVAL = 1.0
+REPLAY_TOKEN = 'replay'
+
+
+def _quota(value):
+    label, number = value.split('=')
+    return label, int(number)
 
 
 # gremlinpython==3.2.11
 
 
-def main(args):
+def _configure_logging(args):
     log_level = logging.ERROR if args.quiet else logging.INFO
     logging.basicConfig(level=log_level)
     logging.getLogger('backoff').addHandler(logging.StreamHandler())
     logging.getLogger('backoff').setLevel(log_level)
 
+
+def _storage(args):
+    if args.sqlite is not None:
+        return SqliteStorage(args.sqlite)
+
     graph = Graph()
-    g = graph.traversal().withRemote(DriverRemoteConnection(DB_URL, 'g'))
+    return GremlinStorage(graph.traversal().withRemote(DriverRemoteConnection(DB_URL, 'g',
+                                                                              pool_size=max(4, args.concurrency))))
+
+
+def _metrics(args, worker, index):
+    metrics = Metrics()
+    if args.metrics_file is not None:
+        metrics.write_every(args.metrics_file + worker, args.metrics_interval)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port + index)
+    return metrics
+
+
+def _spider(args, tokens, worker='', index=0):
+    metrics = _metrics(args, worker, index)
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = ResponseCache(args.cache_dir, args.cache_ttl, args.cache_size and args.cache_size * 2 ** 20,
+                              args.cache_scope, args.replay)
+
+    planner = Planner(args.target_cost, args.target_latency) if args.adaptive_pages else None
+
+    github = GitHub(tokens, args.endpoint, pool_size=max(args.pool_size, args.concurrency),
+                    reserve=args.token_change_limit, quiet=args.quiet, cache=cache, planner=planner, metrics=metrics)
+    storage = _storage(args)
+    if args.id_cache_path is None:
+        id_cache = IdCache(args.id_cache_size)
+    else:
+        id_cache = PersistentIdCache(args.id_cache_path + worker, args.id_cache_size, storage)
+
+    scheduler = SCHEDULERS[args.schedule](dict(args.quota))
+    frontier = None if args.frontier is None else Frontier(args.frontier, worker, args.lease_ttl,
+                                                           scheduler.degree_weight)
+    journal = None if args.journal is None else Journal(args.journal)
+
+    spider = Spider(storage, github, args.relatives_cap, args.max_property_size, args.batch_size, args.write_batch_size,
+                    id_cache, frontier, scheduler, journal, args.pull_requests)
+    return spider, github, frontier
+
+
+def _crawl(spider, args):
+    while spider.has_unprocessed(args.skip_errors):
+        if args.concurrency > 1:
+            spider.process_async(args.concurrency, args.quiet, not args.fifo, args.skip_errors)
+        else:
+            spider.process(args.quiet, not args.fifo, args.skip_errors)
+
+
+def _work(args, worker, index, tokens, stop):
+    _configure_logging(args)
+    spider, _, frontier = _spider(args, tokens, worker, index)
+    frontier.keep_alive()
+    # nodes leased by other workers may still discover new ones, so wait for them until the frontier is drained
+    while not stop.is_set():
+        if spider.has_unprocessed(args.skip_errors):
+            _crawl(spider, args)
+        elif frontier.pending(args.skip_errors, spider.scheduler.exhausted()):
+            stop.wait(POLL_INTERVAL)
+        else:
+            break
+
+
+def _supervise(args):
+    frontier = Frontier(args.frontier, 'supervisor', args.lease_ttl, SCHEDULERS[args.schedule].degree_weight)
+    # spawned workers open their own connections instead of sharing the ones inherited by a fork
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    processes = {}
+    for n in range(args.workers):
+        worker = 'worker-{}'.format(n)
+        processes[worker] = context.Process(target=_work, name=worker,
+                                            args=(args, worker, n + 1, args.tokens[n::args.workers], stop))
+        processes[worker].start()
+
+    try:
+        _wait(args, frontier, processes)
+    except KeyboardInterrupt:
+        stop.set()
+        _wait(args, frontier, processes)
+
+
+def _wait(args, frontier, processes):
+    while processes:
+        wait([process.sentinel for process in processes.values()], timeout=PROGRESS_INTERVAL)
+        for worker, process in list(processes.items()):
+            if not process.is_alive():
+                # give nodes of a dead worker back without waiting for its leases to expire
+                frontier.release(worker)
+                logging.info('{} finished with exit code {}.'.format(worker, process.exitcode))
+                del processes[worker]
+
+        if not args.quiet:
+            for progress in frontier.progress():
+                logging.info('{worker}: {processed} processed, {errors} errors.'.format(**progress))
+
+
+def main(args):
+    _configure_logging(args)
+
+    if args.replay and not args.tokens:
+        # replayed responses come from the cache, so the token is never sent
+        args.tokens = [REPLAY_TOKEN] * args.workers
+
+    if args.workers > 1 and (args.frontier is None or len(args.tokens) < args.workers):
+        raise ValueError('Workers need a --frontier and at least one token each.')
+
+    spider, github, frontier = _spider(args, args.tokens)
 
-    github = GitHub(args.tokens[0])
-    spider = Spider(g, github, args.relatives_cap, args.max_property_size, args.tokens)
+    if frontier is not None:
+        frontier.release()
+        if not len(frontier):
+            spider.rebuild_frontier()
 
-    print(github.get_rate_limit())
+    if not args.replay:
+        print(github.get_rate_limit())
 
     spider.load_repository("https://github.com/tensorflow/tensorflow")
 
     print('Loaded seeds.')
 
-    while spider.has_unprocessed():
-        spider.process(args.token_change_limit, args.quiet, not args.fifo, args.skip_errors)
+    if args.workers > 1:
+        _supervise(args)
+    else:
+        _crawl(spider, args)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--db-url', type=str, default=DB_URL)
+    parser.add_argument('--endpoint', type=str, default=None,
+                        help="GitHub GraphQL endpoint, e.g. the url of a `loader.fake` server.")
+    parser.add_argument('--sqlite', type=str, default=None,
+                        help="Keep the graph in this SQLite file instead of the Gremlin server.")
     parser.add_argument('--quiet', action='store_true')
     parser.add_argument('--skip-errors', action='store_true')
     parser.add_argument('--fifo', action='store_true')
     parser.add_argument('--relatives-cap', type=int, default=10000)
     parser.add_argument('--max-property-size', type=int, default=65534)
-    parser.add_argument('--token-change-limit', type=int, default=400)
+    parser.add_argument('--token-change-limit', type=int, default=RESERVE,
+                        help="Rate limit points left untouched on every token.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="Number of connection pages packed into a single GraphQL query.")
+    parser.add_argument('--write-batch-size', type=int, default=WRITE_BATCH_SIZE,
+                        help="Number of relatives upserted by a single graph write.")
+    parser.add_argument('--id-cache-size', type=int, default=ID_CACHE_SIZE,
+                        help="Number of vertex ids kept in memory by uri.")
+    parser.add_argument('--id-cache-path', type=str, default=None,
+                        help="File persisting the vertex ids by uri between runs.")
+    parser.add_argument('--frontier', type=str, default=None,
+                        help="SQLite file of the crawl frontier, unprocessed nodes are looked up in the graph without it.")
+    parser.add_argument('--journal', type=str, default=None,
+                        help="SQLite file of connection cursors, so interrupted nodes resume from their last page.")
+    parser.add_argument('--schedule', choices=sorted(SCHEDULERS), default='fifo',
+                        help="Order in which frontier nodes are processed, requires --frontier.")
+    parser.add_argument('--quota', type=_quota, action='append', default=[],
+                        help="Maximum number of nodes with a label processed by the whole crawl of every process, e.g. "
+                             "user=1000.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of spider processes sharing the --frontier, tokens are split between them.")
+    parser.add_argument('--lease-ttl', type=float, default=LEASE_TTL,
+                        help="Seconds after which frontier nodes leased by an unresponsive worker are taken over.")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE,
+                        help="Number of kept-alive HTTP connections to the GitHub API.")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Number of nodes processed concurrently.")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help="Directory of the GitHub response cache, disabled by default.")
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help="Seconds after which cached responses are refetched.")
+    parser.add_argument('--cache-size', type=int, default=None,
+                        help="Size of the response cache in MiB.")
+    parser.add_argument('--cache-scope', type=str, default='public',
+                        help="Scope of the tokens, responses are cached per scope.")
+    parser.add_argument('--replay', action='store_true',
+                        help="Serve GitHub responses from the cache only, --tokens are not needed.")
+    parser.add_argument('--adaptive-pages', action='store_true',
+                        help="Adapt page sizes to query cost and latency, shrinking them on 502s and timeouts.")
+    parser.add_argument('--target-cost', type=float, default=TARGET_COST,
+                        help="Rate limit points per connection page above which pages stop growing.")
+    parser.add_argument('--target-latency', type=float, default=TARGET_LATENCY,
+                        help="Seconds per query above which pages get smaller.")
+    parser.add_argument('--pull-requests', action='store_true',
+                        help="Crawl pull requests of repositories and users, best with --adaptive-pages.")
+    parser.add_argument('--metrics-file', type=str, default=None,
+                        help="JSON file the crawl metrics are periodically written into, suffixed by worker name.")
+    parser.add_argument('--metrics-interval', type=float, default=SNAPSHOT_INTERVAL,
+                        help="Seconds between two writes of the --metrics-file.")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve the crawl metrics on http://localhost:PORT/metrics, workers use the next ports.")
     parser.add_argument('--tokens', nargs='+',type=str,
                         help="See https://help.github.com/en/articles/creating-a-personal-access-token-for-the-command-line.")
     main(parser.parse_args())
@@ -0,0 +1,111 @@
+"""On-disk cache of GitHub API responses."""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SUFFIX = '.json.gz'
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+class ResponseCache:
+    """Content addressed response cache keyed on the rendered query and the token scope.
+
+    Entries older than `ttl` seconds are refetched, the least recently used entries are evicted once the cache
+    grows over `max_size` bytes. In `replay` mode the cache is never refreshed and a miss raises `CacheMiss`.
+    The file mtime records when an entry was stored and its atime when it was last used.
+    """
+
+    def __init__(self, directory, ttl=None, max_size=None, scope='public', replay=False):
+        super().__init__()
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.scope = scope
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_atime, name[:-len(SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    def _key(self, query):
+        return hashlib.sha256('{}\n{}'.format(self.scope, query).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _miss(self, key):
+        self.misses += 1
+        if self.replay:
+            raise CacheMiss(key)
+
+    def get(self, query):
+        key = self._key(query)
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                self._miss(key)
+                return None
+
+            stored = os.stat(path).st_mtime
+            if not self.replay and self.ttl is not None and time.time() - stored > self.ttl:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            os.utime(path, (time.time(), stored))
+
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            # evicted by a concurrent `put` since the lookup
+            with self._lock:
+                self.hits -= 1
+                self._miss(key)
+            return None
+
+    def put(self, query, data):
+        if self.replay:
+            return
+
+        key = self._key(query)
+        path = self._path(key)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = os.path.getsize(path)
+            self._size += self._entries[key]
+            self._evict()
+
+    def _evict(self):
+        while self.max_size is not None and self._size > self.max_size and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
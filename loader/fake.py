@@ -0,0 +1,232 @@
+"""Local stand-in for the GitHub GraphQL API serving a synthetic graph."""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RATE_LIMIT = 5000
+RATE_LIMIT_WINDOW = 3600.0
+
+SELECTOR = re.compile(r'(?:(\w+): )?(?:node\(id: "([^"]*)"\)|resource\(url: "([^"]*)"\))')
+CONNECTION = re.compile(r'(\w+)\(first: (\d+), after: (?:null|"([^"]*)")\)')
+
+# connection field: kind of its items, R(epository), U(ser), L(anguage) or a leaf
+REPOSITORY_CONNECTIONS = {
+    'forks': 'R',
+    'languages': 'L',
+    'assignableUsers': 'U',
+    'collaborators': 'U',
+    'stargazers': 'U',
+    'commitComments': 'C',
+    'releases': 'E',
+    'issues': 'I',
+    'milestones': 'M',
+    'pullRequests': 'P',
+}
+
+USER_CONNECTIONS = {
+    'commitComments': 'C',
+    'followers': 'U',
+    'following': 'U',
+    'issues': 'I',
+    'pullRequests': 'P',
+    'repositories': 'R',
+    'repositoriesContributedTo': 'R',
+    'watching': 'R',
+}
+
+
+def _hash(*parts):
+    return zlib.crc32('/'.join(str(part) for part in parts).encode())
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeGraph:
+    """Deterministic graph of `repositories` repositories, `users` users and `languages` languages.
+
+    Every connection of a repository or a user has on average `fan_out` items, taken from a contiguous range of
+    the target kind, so a crawl always ends. Commit comments, releases, issues, milestones and pull requests are
+    leaves owned by their repository or user.
+    """
+
+    def __init__(self, repositories=100, users=1000, languages=20, fan_out=10):
+        super().__init__()
+        self.sizes = {'R': repositories, 'U': users, 'L': languages}
+        self.fan_out = fan_out
+
+    def resolve(self, url):
+        """Id of the repository at `url`."""
+        return 'R{}'.format(_hash(url) % self.sizes['R'])
+
+    def total_count(self, owner, field):
+        kind = self._connections(owner)[field]
+        count = _hash(owner, field) % (2 * self.fan_out + 1)
+        return min(count, self.sizes[kind]) if kind in self.sizes else count
+
+    def items(self, owner, field, start, end):
+        kind = self._connections(owner)[field]
+        if kind not in self.sizes:
+            return [self.node('{}{}x{}'.format(kind, owner, n)) for n in range(start, end)]
+
+        base = _hash(owner, field, 'base')
+        nodes = [self.node('{}{}'.format(kind, (base + n) % self.sizes[kind])) for n in range(start, end)]
+        if kind == 'L':
+            return [{'size': 1000 * (1 + _hash(owner, node['id']) % 100), 'node': node} for node in nodes]
+        return nodes
+
+    def _connections(self, owner):
+        return REPOSITORY_CONNECTIONS if owner.startswith('R') else USER_CONNECTIONS
+
+    def node(self, node_id):
+        kind, n = node_id[0], _hash(node_id)
+        created = _timestamp(1200000000 + n % 300000000)
+        url = 'https://github.com/fake/{}'.format(node_id)
+        if kind == 'R':
+            return {'id': node_id, 'name': node_id, 'description': 'Repository ' + node_id, 'createdAt': created,
+                    'diskUsage': n % 100000, 'forkCount': n % 1000, 'squashMergeAllowed': n % 2 == 0,
+                    'pushedAt': created, 'isArchived': False, 'isDisabled': False, 'isFork': n % 5 == 0,
+                    'isLocked': False, 'isMirror': False, 'isPrivate': False, 'url': url}
+        if kind == 'U':
+            return {'id': node_id, 'name': node_id, 'login': node_id.lower(), 'bio': 'bio' if n % 3 else None,
+                    'company': 'company' if n % 4 == 0 else None, 'createdAt': created, 'isHireable': n % 2 == 0,
+                    'location': None, 'updatedAt': created, 'url': url}
+        if kind == 'L':
+            return {'id': node_id, 'name': 'Language' + node_id[1:]}
+        if kind == 'E':
+            return {'id': node_id, 'name': node_id, 'createdAt': created, 'isDraft': n % 7 == 0,
+                    'isPrerelease': n % 5 == 0, 'url': url}
+        return {'id': node_id, 'createdAt': created, 'closed': n % 2 == 0, 'bodyText': 'text ' * (n % 20),
+                'url': url}
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    """HTTP server answering the queries of `loader.github` from a `FakeGraph`.
+
+    Every request sleeps `latency` seconds plus `latency_per_item` for every requested item, fails with a 502 with
+    probability `error_rate` or when it asks for more than `max_items` items. Rate limits are kept per token, with
+    the cost of a query being its requested items per hundred.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, graph=None, port=0, latency=0.0, latency_per_item=0.0, error_rate=0.0, max_items=None,
+                 rate_limit=RATE_LIMIT, seed=0):
+        super().__init__(('127.0.0.1', port), FakeGitHubHandler)
+        self.graph = FakeGraph() if graph is None else graph
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.error_rate = error_rate
+        self.max_items = max_items
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._window = time.time()
+        self._used = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/graphql'.format(*self.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def charge(self, token, cost):
+        """Takes `cost` points from `token`, returns its rate limit or None if it has not enough left."""
+        with self._lock:
+            self.requests += 1
+            if time.time() > self._window + RATE_LIMIT_WINDOW:
+                self._window, self._used = time.time(), {}
+            used = self._used.get(token, 0)
+            rate = {'limit': self.rate_limit, 'cost': cost, 'resetAt': _timestamp(self._window + RATE_LIMIT_WINDOW)}
+            if used + cost > self.rate_limit:
+                rate['remaining'] = self.rate_limit - used
+                return None, rate
+            self._used[token] = used + cost
+            rate['remaining'] = self.rate_limit - used - cost
+            return rate, rate
+
+    def answer(self, query):
+        selectors = list(SELECTOR.finditer(query))
+        data = {}
+        for n, selector in enumerate(selectors):
+            alias, node_id, url = selector.groups()
+            node_id = node_id or self.graph.resolve(url)
+            key = alias or ('node' if url is None else 'resource')
+
+            end = selectors[n + 1].start() if n + 1 < len(selectors) else len(query)
+            connection = CONNECTION.search(query, selector.end(), end)
+            if connection is None:
+                data[key] = self.graph.node(node_id)
+                continue
+
+            field, first, cursor = connection.group(1), int(connection.group(2)), connection.group(3)
+            start = int(cursor) if cursor else 0
+            total_count = self.graph.total_count(node_id, field)
+            stop = min(total_count, start + first)
+            data[key] = {field: {
+                'totalCount': total_count,
+                'edges' if field == 'languages' else 'nodes': self.graph.items(node_id, field, start, stop),
+                'pageInfo': {'endCursor': str(stop), 'hasNextPage': stop < total_count},
+            }}
+        return data
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body, rate=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if rate is not None:
+            self.send_header('X-RateLimit-Limit', str(rate['limit']))
+            self.send_header('X-RateLimit-Remaining', str(rate['remaining']))
+            self.send_header('X-RateLimit-Reset', rate['resetAt'])
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+        items = sum(int(first) for first in re.findall(r'first: (\d+)', query))
+        time.sleep(server.latency + server.latency_per_item * items)
+
+        if (server.max_items is not None and items > server.max_items) or \
+                (server.error_rate > 0.0 and server.random.random() < server.error_rate):
+            with server._lock:
+                server.errors += 1
+            self._respond(502, {'message': 'Server Error'})
+            return
+
+        token = self.headers.get('Authorization', '')
+        rate, headers = server.charge(token, max(1, math.ceil(items / 100)))
+        if rate is None:
+            self._respond(200, {'data': None, 'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]},
+                          headers)
+            return
+
+        data = server.answer(query)
+        if 'rateLimit' in query:
+            data['rateLimit'] = rate
+        self._respond(200, {'data': data}, headers)
@@ -0,0 +1,226 @@
+"""Persistent crawl frontier."""
+
+import json
+import sqlite3
+import threading
+import time
+
+LEASE_SIZE = 100
+LEASE_TTL = 900.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    uri TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    vertex_id TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0.0,
+    depth INTEGER NOT NULL DEFAULT 0,
+    seen INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    attempted REAL NOT NULL DEFAULT 0.0,
+    worker TEXT,
+    lease_until REAL NOT NULL DEFAULT 0.0,
+    error TEXT,
+    rank REAL NOT NULL DEFAULT 0.0
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+"""
+
+# lease orders are served by these indexes, so a lease reads about as many rows as it hands out
+INDEXES = """
+DROP INDEX IF EXISTS frontier_order;
+CREATE INDEX IF NOT EXISTS frontier_rank ON frontier (rank DESC, created);
+CREATE INDEX IF NOT EXISTS frontier_repos_first ON frontier (label != 'repository', rank DESC, created);
+CREATE INDEX IF NOT EXISTS frontier_worker ON frontier (worker);
+"""
+
+
+class Frontier:
+    """SQLite queue of `(label, uri, vertex_id, priority, attempts)` nodes waiting to be processed.
+
+    Nodes are pushed whenever the spider merges a vertex and removed once processed, so finding work never
+    has to scan the graph. Every node is handed out at most once per iteration. Pushing a known node counts
+    it as seen once more, keeps its highest priority and its shortest distance from the seeds. Nodes are ranked
+    by `priority + degree_weight * seen`, kept up to date in an indexed column.
+
+    Several processes may share one frontier file, each opening it with its own `worker` name. Leased nodes
+    belong to their worker until `lease_ttl` seconds pass without a `renew`, after which any worker can take
+    them over. Processed and failed counts of every worker are kept in the `workers` table.
+    """
+
+    def __init__(self, path, worker='', lease_ttl=LEASE_TTL, degree_weight=0.0):
+        super().__init__()
+        self.path = path
+        self.worker = worker
+        self.lease_ttl = lease_ttl
+        self.degree_weight = degree_weight
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60.0, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        if 'rank' not in [row[1] for row in self._db.execute('PRAGMA table_info(frontier)')]:
+            self._db.execute('ALTER TABLE frontier ADD COLUMN rank REAL NOT NULL DEFAULT 0.0')
+        self._db.executescript(INDEXES)
+        # frontiers written before ranks were stored or with another degree weight
+        self._transaction(self._db.execute, 'UPDATE frontier SET rank = priority + ? * seen '
+                                            'WHERE rank != priority + ? * seen', (degree_weight, degree_weight))
+        self._db.execute('INSERT OR IGNORE INTO workers (worker, heartbeat) VALUES (?, ?)', (worker, time.time()))
+
+    def _transaction(self, function, *args):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(*args)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return result
+
+    def push(self, label, uri, vertex_id, priority=0.0, depth=0):
+        self.push_many([(label, uri, vertex_id, priority, depth)])
+
+    def push_many(self, nodes):
+        now = time.time()
+        weight = self.degree_weight
+        self._transaction(self._db.executemany, """
+            INSERT INTO frontier (uri, label, vertex_id, priority, depth, created, rank) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (uri) DO UPDATE SET
+                created = excluded.created,
+                priority = max(priority, excluded.priority),
+                depth = min(depth, excluded.depth),
+                seen = seen + 1,
+                rank = max(priority, excluded.priority) + ? * (seen + 1)
+        """, [(uri, label, json.dumps(vertex_id), priority, depth, now, priority + weight, weight)
+              for label, uri, vertex_id, priority, depth in nodes])
+
+    def _where(self, skip_errors, excluded_labels=()):
+        # nodes not attempted in this iteration, or whose lease has expired
+        where = 'created <= ? AND lease_until < ? AND (attempted < ? OR lease_until > 0.0)'
+        if skip_errors:
+            where += ' AND error IS NULL'
+        if excluded_labels:
+            where += ' AND label NOT IN ({})'.format(', '.join('?' * len(excluded_labels)))
+        return where
+
+    def _order(self, repos_first):
+        order = 'rank DESC, created'
+        if repos_first:
+            order = "label != 'repository', " + order
+        return order
+
+    def count(self, before=None, skip_errors=False, excluded_labels=()):
+        before = time.time() if before is None else before
+        excluded_labels = list(excluded_labels)
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM frontier WHERE ' + self._where(skip_errors, excluded_labels),
+                                    [before, time.time(), before] + excluded_labels).fetchone()[0]
+
+    def pending(self, skip_errors=False, excluded_labels=()):
+        """Number of nodes left to process by any worker, including nodes leased by others."""
+        where = 'error IS NULL' if skip_errors else '1'
+        if excluded_labels:
+            where += ' AND label NOT IN ({})'.format(', '.join('?' * len(excluded_labels)))
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM frontier WHERE ' + where,
+                                    list(excluded_labels)).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM frontier').fetchone()[0]
+
+    def lease(self, before, n=LEASE_SIZE, repos_first=True, skip_errors=True, excluded_labels=()):
+        """Leases up to `n` best ranked nodes created before `before` which were not attempted since."""
+        excluded_labels = list(excluded_labels)
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                rows = self._db.execute(
+                    'SELECT vertex_id, label, uri, depth FROM frontier WHERE {} ORDER BY {} LIMIT ?'.format(
+                        self._where(skip_errors, excluded_labels), self._order(repos_first)),
+                    [before, now, before] + excluded_labels + [n]).fetchall()
+                self._db.executemany("""
+                    UPDATE frontier SET attempted = ?, attempts = attempts + 1, worker = ?, lease_until = ?
+                    WHERE uri = ?
+                """, [(now, self.worker, now + self.lease_ttl, uri) for _, _, uri, _ in rows])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return [(json.loads(vertex_id), label, uri, depth) for vertex_id, label, uri, depth in rows]
+
+    def iterate(self, before, repos_first=True, skip_errors=True, scheduler=None, lease_size=LEASE_SIZE):
+        """Yields nodes in scheduler order until the frontier is drained or all label quotas are used up."""
+        while True:
+            remaining = {} if scheduler is None else scheduler.remaining()
+            excluded_labels = [label for label, left in remaining.items() if left <= 0]
+            # never lease more nodes than the smallest quota left, so no label overshoots its quota
+            size = min([lease_size] + [left for left in remaining.values() if left > 0])
+            nodes = self.lease(before, size, repos_first, skip_errors, excluded_labels)
+            if not nodes:
+                return
+            for node in nodes:
+                if scheduler is not None:
+                    scheduler.take(node[1])
+                yield node
+
+    def complete(self, uri):
+        with self._lock:
+            self._db.execute('DELETE FROM frontier WHERE uri = ?', (uri,))
+            self._db.execute('UPDATE workers SET processed = processed + 1 WHERE worker = ?', (self.worker,))
+
+    def fail(self, uri, error):
+        with self._lock:
+            self._db.execute('UPDATE frontier SET error = ?, worker = NULL, lease_until = 0.0 WHERE uri = ?',
+                             (error, uri))
+            self._db.execute('UPDATE workers SET errors = errors + 1, last_error = ? WHERE worker = ?',
+                             (error, self.worker))
+
+    def renew(self):
+        """Extends leases of this worker."""
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE frontier SET lease_until = ? WHERE worker = ? AND lease_until > 0.0',
+                             (now + self.lease_ttl, self.worker))
+            self._db.execute('UPDATE workers SET heartbeat = ? WHERE worker = ?', (now, self.worker))
+
+    def keep_alive(self, interval=None):
+        """Renews leases from a daemon thread every `interval` seconds."""
+        interval = self.lease_ttl / 3 if interval is None else interval
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.renew()
+
+        thread = threading.Thread(target=run, name='frontier-keep-alive', daemon=True)
+        thread.start()
+        return thread
+
+    def release(self, worker=None):
+        """Returns nodes leased by `worker`, or by everybody, to the frontier."""
+        with self._lock:
+            if worker is None:
+                self._db.execute('UPDATE frontier SET worker = NULL, lease_until = 0.0, attempted = 0.0 '
+                                 'WHERE lease_until > 0.0')
+            else:
+                self._db.execute('UPDATE frontier SET worker = NULL, lease_until = 0.0, attempted = 0.0 '
+                                 'WHERE worker = ? AND lease_until > 0.0', (worker,))
+
+    def progress(self):
+        with self._lock:
+            rows = self._db.execute('SELECT worker, heartbeat, processed, errors, last_error FROM workers '
+                                    'ORDER BY worker').fetchall()
+        return [dict(zip(('worker', 'heartbeat', 'processed', 'errors', 'last_error'), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
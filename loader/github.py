@@ -2,43 +2,99 @@
 
 import logging
 import re
+import time
 from pprint import pformat
 from string import Template
 
 import backoff
 import requests
+import requests.adapters
 
 from loader import queries
+from loader.metrics import Metrics
+from loader.tokens import TokenPool, RESERVE
 
 DEFAULT_ENDPOINT = 'https://api.github.com/graphql'
+BATCH_SIZE = 10
+POOL_SIZE = 10
+REQUEST_TIMEOUT = 60.0
+
+
+class QueryTimeout(RuntimeError):
+    pass
 
 
 def _is_id(id_or_url):
     return re.match(r'^[A-Za-z0-9+/]*={0,2}$', id_or_url)
 
 
+def _with_rate_limit(query):
+    return query.replace('query {', 'query {' + queries.RATE_LIMIT, 1)
+
+
+def _is_rate_limited(errors):
+    return any(error.get('type') == 'RATE_LIMITED' for error in errors)
+
+
+def _is_timeout(errors):
+    return any('timeout' in error.get('message', '').lower() for error in errors)
+
+
+def _is_overloaded(exception):
+    """Whether a query failed because it was too expensive for GitHub to answer in time."""
+    if isinstance(exception, requests.exceptions.HTTPError):
+        return exception.response is not None and exception.response.status_code in (502, 503, 504)
+    return isinstance(exception, (QueryTimeout, requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def _never(exception):
+    return False
+
+
 def _on_backoff(details):
     logging.info(pformat(details['args'][1]))
 
 
 class Connection:
 
-    def __init__(self, token, endpoint=None):
+    def __init__(self, token, endpoint=None, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
         super().__init__()
         self.endpoint = endpoint or DEFAULT_ENDPOINT
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
         self.token = token
 
+    @property
+    def token(self):
+        return self._token
 
-    @backoff.on_exception(backoff.fibo, requests.exceptions.HTTPError, max_tries=5, on_backoff=_on_backoff)
-    def query(self, query, ignore_error=False):
-        headers = {'Authorization': 'bearer {}'.format(self.token)}
+    @token.setter
+    def token(self, token):
+        self._token = token
+        self.session.headers['Authorization'] = 'bearer {}'.format(token)
 
-        response = requests.post(self.endpoint, json={'query': query}, headers=headers)
+    def _query(self, query, ignore_error=False, token=None):
+        headers = None if token is None else {'Authorization': 'bearer {}'.format(token)}
+
+        response = self.session.post(self.endpoint, json={'query': query}, headers=headers, timeout=self.timeout)
 
         if not ignore_error:
             response.raise_for_status()
         return response
 
+    def query(self, query, ignore_error=False, token=None, giveup=_never):
+        """Posts `query`, retrying HTTP errors with a backoff unless `giveup` of the error is true."""
+        # errors a caller gives up on are handled by it, e.g. by shrinking pages, so they are no errors to log
+        retried = backoff.on_exception(backoff.fibo, requests.exceptions.HTTPError, max_tries=5, giveup=giveup,
+                                       on_backoff=_on_backoff,
+                                       giveup_log_level=logging.ERROR if giveup is _never else logging.INFO)(
+            Connection._query)
+        return retried(self, query, ignore_error, token)
+
 
 def _selector(id_or_url):
     if _is_id(id_or_url):
@@ -51,20 +107,70 @@ def _cursor(cursor):
     return 'null' if cursor is None else '"{}"'.format(cursor)
 
 
+def _alias(n):
+    return 'c{}'.format(n)
+
+
 class GitHub:
 
-    def __init__(self, token, endpoint=None):
+    def __init__(self, tokens, endpoint=None, pool_size=POOL_SIZE, reserve=RESERVE, quiet=False, cache=None,
+                 planner=None, metrics=None):
         super().__init__()
-        self.connection = Connection(token, endpoint)
-        self.token_number = 0
-
-    def _get(self, id_or_url, query):
-        response = self.connection.query(query).json()
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        self.tokens = TokenPool(tokens, reserve, quiet)
+        self.connection = Connection(tokens[0], endpoint, pool_size)
+        self.cache = cache
+        self.planner = planner
+        self.metrics = Metrics() if metrics is None else metrics
+
+    def _post(self, query, connections=('single',), giveup=_never):
+        if self.cache is not None:
+            data = self.cache.get(query)
+            self.metrics.count('cache', hit=data is not None)
+            if data is not None:
+                return data
+
+        data = self._fetch(query, connections, giveup)
+
+        if self.cache is not None:
+            self.cache.put(query, data)
+        return data
+
+    def _observe(self, name, seconds, connections, **tags):
+        # time of a batch query is split evenly between the connections it fetches
+        for connection in connections:
+            self.metrics.observe(name, seconds / len(connections), connection=connection, **tags)
+
+    def _fetch(self, query, connections=('single',), giveup=_never):
+        token = self.tokens.acquire()
+        token_name = self.tokens.name(token)
+        start = time.perf_counter()
+        response = self.connection.query(_with_rate_limit(query), token=token, giveup=giveup)
+        fetched = time.perf_counter()
+        response = response.json()
+        self._observe('http', fetched - start, connections, token=token_name)
+        self._observe('decode', time.perf_counter() - fetched, connections)
+
+        data = response.get('data') or {}
+        if data.get('rateLimit'):
+            self.tokens.update(token, data['rateLimit'])
+            self.metrics.count('cost', data['rateLimit']['cost'], token=token_name)
+            self.metrics.gauge('remaining', data['rateLimit']['remaining'], token=token_name)
 
         if 'errors' in response:
+            self.metrics.count('errors', token=token_name)
+            if _is_rate_limited(response['errors']):
+                self.tokens.exhaust(token)
+                return self._fetch(query, connections, giveup)
+            if _is_timeout(response['errors']):
+                raise QueryTimeout(response['errors'])
             raise RuntimeError(response['errors'])
 
-        data = response['data']
+        return data
+
+    def _get(self, id_or_url, query):
+        data = self._post(query)
         if _is_id(id_or_url):
             return data['node']
         else:
@@ -104,6 +210,78 @@ class GitHub:
             return edges, total_count, cursor, has_next
         yield from self.__paginated(standard, limit=limit)
 
+    def _batch_query(self, pages):
+        aliases = []
+        fragments = set()
+        for n, (id_or_url, connection, cursor) in enumerate(pages):
+            owner, field, first, _, items, fragment = queries.CONNECTIONS[connection]
+            if self.planner is not None:
+                first = self.planner.page_size(connection)
+            aliases.append(Template(queries.BATCH_ALIAS).substitute(
+                alias=_alias(n), selector=_selector(id_or_url), owner=owner, field=field, first=first,
+                cursor=_cursor(cursor), items=items))
+            fragments.add(fragment)
+        return Template(queries.BATCH).substitute(aliases=''.join(aliases)) + ''.join(sorted(fragments))
+
+    def get_batched_pages(self, pages, limit=None, batch_size=BATCH_SIZE):
+        """Fetches many connections of many entities with aliased queries.
+
+        `pages` are `(id_or_url, connection)` or `(id_or_url, connection, cursor)` tuples, where connection is
+        a key of `queries.CONNECTIONS`. Up to `batch_size` pages are packed into a single query and every
+        unfinished connection is requested again in the following round. Yields
+        `((id_or_url, connection), items, end_cursor, has_next)` for every page received.
+
+        With a planner, page sizes follow it and a batch failing with a 502 or a timeout is retried with smaller
+        pages until they reach the minimum.
+        """
+        pending = [(page[0], page[1], page[2] if len(page) > 2 else None) for page in pages]
+        while pending:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            data = self._post_batch(batch)
+            if data is None:
+                pending = batch + pending
+                continue
+            for n, (id_or_url, connection, _) in enumerate(batch):
+                _, field, _, items_key, _, _ = queries.CONNECTIONS[connection]
+                output = data[_alias(n)][field]
+                total_count = output['totalCount']
+                cursor = output['pageInfo']['endCursor']
+                has_next = output['pageInfo']['hasNextPage']
+                if limit is not None and total_count > limit:
+                    raise RuntimeError('Nodes exided total limit: {} > {}'.format(total_count, limit))
+                if has_next:
+                    pending.append((id_or_url, connection, cursor))
+                self.metrics.count('pages', connection=connection)
+                self.metrics.count('items', len(output[items_key]), connection=connection)
+                yield (id_or_url, connection), output[items_key], cursor, has_next
+
+    def _post_batch(self, batch):
+        """Data of the batch query, `None` if it failed and the planner made its pages smaller."""
+        connections = [connection for _, connection, _ in batch]
+        if self.planner is None:
+            return self._post(self._batch_query(batch), connections)
+
+        start = time.time()
+        # overloaded queries are retried right away with smaller pages, backing off only once they cannot shrink,
+        # any other error is backed off as usual
+        giveup = _is_overloaded if self.planner.shrinkable(connections) else _never
+        try:
+            data = self._post(self._batch_query(batch), connections, giveup)
+        except Exception as e:
+            if _is_overloaded(e) and self.planner.fail(connections):
+                logging.info('Retrying {} with smaller pages after {!r}.'.format(sorted(set(connections)), e))
+                return None
+            raise
+
+        self.planner.observe(connections, (data.get('rateLimit') or {}).get('cost', 1), time.time() - start)
+        return data
+
+    def get_batched(self, pages, limit=None, batch_size=BATCH_SIZE):
+        results = {}
+        for key, items, _, _ in self.get_batched_pages(pages, limit, batch_size):
+            results.setdefault(key, []).extend(items)
+        return results
+
     def get_rate_limit(self):
         return self.connection.query("""
         query {
@@ -116,19 +294,6 @@ class GitHub:
         }
         """).json()['data']['rateLimit']
 
-    def adjust_token(self, tokens, quiet, change_limit):
-        if len(tokens) > 1:
-            rate = self.get_rate_limit()
-            if rate['remaining'] < change_limit:
-                self.token_number = self.token_number + 1
-                self._change_token(tokens[self.token_number % len(tokens)])
-                if not quiet:
-                    logging.info('Token change with {} points remaining. resetAt {}'.format(rate['remaining'], rate['resetAt']))
-
-
-    def _change_token(self, token, endpoint=None):
-        self.connection = Connection(token, endpoint)
-
     def get_repository(self, id_or_url):
         return self._get(id_or_url, Template(queries.REPOSITORY).substitute(selector=_selector(id_or_url)))
 
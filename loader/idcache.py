@@ -0,0 +1,107 @@
+"""Cache of vertex ids by `_uri`."""
+
+import dbm
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+ID_CACHE_SIZE = 1000000
+# uris never start with a NUL, so this key cannot collide with a cached one
+GRAPH_KEY = b'\x00graph'
+
+
+class IdCache:
+    """Bounded LRU map from `_uri` to vertex id with hit/miss statistics."""
+
+    def __init__(self, maxsize=ID_CACHE_SIZE):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _load(self, uri):
+        return None
+
+    def _store(self, uri, node_id):
+        pass
+
+    def get(self, uri):
+        with self._lock:
+            node_id = self._ids.get(uri)
+            if node_id is None:
+                node_id = self._load(uri)
+                if node_id is not None:
+                    self._remember(uri, node_id)
+            else:
+                self._ids.move_to_end(uri)
+
+            if node_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return node_id
+
+    def _remember(self, uri, node_id):
+        self._ids[uri] = node_id
+        self._ids.move_to_end(uri)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def put(self, uri, node_id):
+        with self._lock:
+            self._remember(uri, node_id)
+            self._store(uri, node_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._ids),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        pass
+
+
+class PersistentIdCache(IdCache):
+    """`IdCache` backed by a dbm file, so ids survive restarts while the LRU keeps the hot part in memory.
+
+    The first id stored is kept as a sample of the graph the ids come from. Opened with the `storage` of the
+    crawl, the file is cleared if the sample is not in it, e.g. after the graph was wiped.
+    """
+
+    def __init__(self, path, maxsize=ID_CACHE_SIZE, storage=None):
+        super().__init__(maxsize)
+        self.path = path
+        self._db = dbm.open(path, 'c')
+        if storage is not None:
+            self._check(storage)
+
+    def _check(self, storage):
+        sample = self._db.get(GRAPH_KEY)
+        if sample is None:
+            return
+        uri, node_id = json.loads(sample)
+        if storage.node_id(uri) != node_id:
+            logging.info('Clearing id cache {}, its ids belong to another graph.'.format(self.path))
+            self._db.close()
+            self._db = dbm.open(self.path, 'n')
+
+    def _load(self, uri):
+        node_id = self._db.get(uri.encode('utf-8'))
+        return None if node_id is None else json.loads(node_id)
+
+    def _store(self, uri, node_id):
+        if GRAPH_KEY not in self._db:
+            self._db[GRAPH_KEY] = json.dumps([uri, node_id])
+        self._db[uri.encode('utf-8')] = json.dumps(node_id)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
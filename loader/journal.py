@@ -0,0 +1,65 @@
+"""Write-ahead journal of partially processed nodes."""
+
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    uri TEXT NOT NULL,
+    connection TEXT NOT NULL,
+    cursor TEXT,
+    pages INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (uri, connection)
+);
+"""
+
+
+class Journal:
+    """SQLite record of the pagination cursor of every connection of the nodes being processed.
+
+    A page is journaled only after its relatives were written to the graph, so after a crash or a timeout the
+    node resumes from the page following the last journaled one. Upserts make writing that page again harmless.
+    Entries of a node are dropped once it is processed.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60.0, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def cursors(self, uri):
+        """`{connection: (cursor, done)}` journaled for `uri`."""
+        with self._lock:
+            rows = self._db.execute('SELECT connection, cursor, done FROM journal WHERE uri = ?', (uri,)).fetchall()
+        return {connection: (cursor, bool(done)) for connection, cursor, done in rows}
+
+    def advance(self, uri, connection, cursor, has_next):
+        """Records that the page of `connection` ending at `cursor` was persisted."""
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO journal (uri, connection, cursor, pages, done, updated) VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (uri, connection) DO UPDATE SET
+                    cursor = excluded.cursor,
+                    pages = pages + 1,
+                    done = excluded.done,
+                    updated = excluded.updated
+            """, (uri, connection, cursor, int(not has_next), time.time()))
+
+    def clear(self, uri):
+        with self._lock:
+            self._db.execute('DELETE FROM journal WHERE uri = ?', (uri,))
+
+    def __len__(self):
+        """Number of nodes with journaled progress."""
+        with self._lock:
+            return self._db.execute('SELECT count(DISTINCT uri) FROM journal').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
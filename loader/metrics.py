@@ -0,0 +1,195 @@
+"""Counters and timers of the crawler's hot paths."""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SNAPSHOT_INTERVAL = 60.0
+PROGRESS_INTERVAL = 5.0
+# timers which do not overlap, so their shares of the time spent add up
+STAGES = ('http', 'decode', 'write', 'lookup')
+
+
+def _key(name, tags):
+    if not tags:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}={}'.format(key, tags[key]) for key in sorted(tags)))
+
+
+class Metrics:
+    """Thread-safe counters, gauges and timers named like `http{connection=user_followers,token=token-0}`.
+
+    Every update takes a lock once and touches a single dict entry, so it is cheap enough for every request and
+    every write. Timers keep their count, total and maximum seconds.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}
+
+    def count(self, name, value=1, **tags):
+        key = _key(name, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **tags):
+        key = _key(name, tags)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **tags):
+        key = _key(name, tags)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def time(self, name, **tags):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **tags)
+
+    def counter(self, name):
+        """Sum of the counters `name` over all their tags."""
+        with self._lock:
+            return sum(value for key, value in self._counters.items() if key.split('{')[0] == name)
+
+    def totals(self):
+        """Total seconds of every timer name over all its tags."""
+        totals = {}
+        with self._lock:
+            for key, (_, total, _) in self._timers.items():
+                name = key.split('{')[0]
+                totals[name] = totals.get(name, 0.0) + total
+        return totals
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'time': time.time(),
+                'uptime': time.time() - self.started,
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'timers': {key: {'count': count, 'seconds': total, 'mean': total / count, 'max': maximum}
+                           for key, (count, total, maximum) in self._timers.items()},
+            }
+
+    def write(self, path):
+        """Atomically replaces `path` with a JSON snapshot."""
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file, indent=1, sort_keys=True)
+        os.replace(temporary, path)
+
+    def write_every(self, path, interval=SNAPSHOT_INTERVAL):
+        """Writes a snapshot into `path` every `interval` seconds from a daemon thread."""
+        def write():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        thread = threading.Thread(target=write, name='metrics', daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves snapshots as JSON on `GET /metrics` from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = json.dumps(metrics.snapshot(), sort_keys=True).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+
+class Progress:
+    """Live line with the throughput, ETA and the stages taking most of the time, in place of a progress bar.
+
+    The line is redrawn at most every `interval` seconds, so `update` costs a clock read in between.
+    """
+
+    def __init__(self, metrics, total=None, unit='node', interval=PROGRESS_INTERVAL, quiet=False, file=None):
+        super().__init__()
+        self.metrics = metrics
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.quiet = quiet
+        self.file = sys.stderr if file is None else file
+        self.done = 0
+        self.started = time.time()
+        self._shown = self.started
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, n=1):
+        with self._lock:
+            self.done += n
+            now = time.time()
+            if self.quiet or now - self._shown < self.interval:
+                return
+            self._shown = now
+        self._show(now)
+
+    def line(self, now=None):
+        elapsed = max((now or time.time()) - self.started, 1e-9)
+        rate = self.done / elapsed
+        done = str(self.done) if not self.total else '{}/{}'.format(self.done, self.total)
+        line = '{} {}s, {:.1f} {}s/s'.format(done, self.unit, rate, self.unit)
+        if self.total:
+            eta = '?' if rate == 0 else timedelta(seconds=int(max(self.total - self.done, 0) / rate))
+            line += ', ETA {}'.format(eta)
+
+        totals = {name: seconds for name, seconds in self.metrics.totals().items() if name in STAGES}
+        spent = sum(totals.values())
+        if spent > 0:
+            line += ', ' + ' '.join('{} {:.0%}'.format(name, totals[name] / spent)
+                                    for name in sorted(totals, key=totals.get, reverse=True))
+        return line
+
+    def _show(self, now):
+        self.file.write('\r' + self.line(now) + '\033[K')
+        self.file.flush()
+
+    def close(self):
+        if not self.quiet:
+            self._show(time.time())
+            self.file.write('\n')
+            self.file.flush()
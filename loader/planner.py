@@ -0,0 +1,77 @@
+"""Adaptive page sizes of GitHub connections."""
+
+import threading
+
+from loader import queries
+
+MIN_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 100
+# pages grow back to at most this share of the smallest page size which failed
+CEILING_SHARE = 0.75
+TARGET_COST = 1.0
+TARGET_LATENCY = 5.0
+
+
+class Planner:
+    """Picks the page size of every connection type from the cost and latency of the queries fetching it.
+
+    Page sizes start at the ones of `queries.CONNECTIONS`. They grow by a tenth while queries are fast and cost
+    at most `target_cost` points per page, shrink by a quarter when queries take longer than `target_latency`
+    seconds and are halved when a query fails with a 502 or a timeout. After a failure, pages of the connection
+    never grow beyond `CEILING_SHARE` of the page size which failed.
+    """
+
+    def __init__(self, target_cost=TARGET_COST, target_latency=TARGET_LATENCY, min_page_size=MIN_PAGE_SIZE,
+                 max_page_size=MAX_PAGE_SIZE):
+        super().__init__()
+        self.target_cost = target_cost
+        self.target_latency = target_latency
+        self.min_page_size = min_page_size
+        self.max_page_size = max_page_size
+        self._lock = threading.Lock()
+        self._page_sizes = {connection: first for connection, (_, _, first, _, _, _) in queries.CONNECTIONS.items()}
+        self._ceilings = {}
+
+    def page_size(self, connection):
+        with self._lock:
+            return self._page_sizes[connection]
+
+    def page_sizes(self):
+        with self._lock:
+            return dict(self._page_sizes)
+
+    def ceiling(self, connection):
+        """Largest page size `connection` may grow to."""
+        with self._lock:
+            return self._ceiling(connection)
+
+    def _ceiling(self, connection):
+        failed = self._ceilings.get(connection)
+        return self.max_page_size if failed is None else max(self.min_page_size, int(failed * CEILING_SHARE))
+
+    def _resize(self, connections, resize):
+        with self._lock:
+            for connection in set(connections):
+                size = resize(self._page_sizes[connection])
+                self._page_sizes[connection] = max(self.min_page_size, min(self._ceiling(connection), size))
+
+    def observe(self, connections, cost, latency):
+        """Adapts page sizes of the `connections` fetched together by a query of `cost` taking `latency` seconds."""
+        if latency > self.target_latency:
+            self._resize(connections, lambda size: int(size * 0.75))
+        elif latency < self.target_latency / 2 and cost / max(1, len(connections)) <= self.target_cost:
+            self._resize(connections, lambda size: size + max(1, size // 10))
+
+    def shrinkable(self, connections):
+        """Whether a page size of `connections` is above the minimum."""
+        return any(self.page_size(connection) > self.min_page_size for connection in connections)
+
+    def fail(self, connections):
+        """Halves page sizes of the `connections` of a failed query, returns False if all were at the minimum."""
+        shrinkable = self.shrinkable(connections)
+        with self._lock:
+            for connection in set(connections):
+                size = self._page_sizes[connection]
+                self._ceilings[connection] = min(self._ceilings.get(connection, size), size)
+        self._resize(connections, lambda size: size // 2)
+        return shrinkable
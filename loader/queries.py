@@ -4,6 +4,14 @@
 from loader import fragments
 
 
+RATE_LIMIT = """
+    rateLimit {
+        cost
+        remaining
+        resetAt
+    }
+"""
+
 REPOSITORY = """
 query {
     $selector {
@@ -356,3 +364,84 @@ query {
     }
 }
 """ + fragments.REPOSITORY
+
+BATCH = """
+query {
+$aliases
+}
+"""
+
+BATCH_ALIAS = """
+    $alias: $selector {
+        ... on $owner {
+            $field(first: $first, after: $cursor) {
+                totalCount
+                $items
+                pageInfo {
+                    endCursor
+                    hasNextPage
+                }
+            }
+        }
+    }
+"""
+
+REPOSITORY_NODES = """nodes {
+                    ... RepositoryFragment
+                }"""
+
+USER_NODES = """nodes {
+                    ... UserFragment
+                }"""
+
+COMMIT_COMMENT_NODES = """nodes {
+                    ... CommitCommentFragment
+                }"""
+
+RELEASE_NODES = """nodes {
+                    ... ReleaseFragment
+                }"""
+
+ISSUE_NODES = """nodes {
+                    ... IssueFragment
+                }"""
+
+MILESTONE_NODES = """nodes {
+                    ... MilestonesFragment
+                }"""
+
+PULL_REQUEST_NODES = """nodes {
+                    ... PullRequestFragment
+                }"""
+
+LANGUAGE_EDGES = """edges {
+                    size
+                    node {
+                        ... LanguageFragment
+                    }
+                }"""
+
+# connection: (owner type, field, page size, items key, items, fragment)
+CONNECTIONS = {
+    'repository_forks': ('Repository', 'forks', 100, 'nodes', REPOSITORY_NODES, fragments.REPOSITORY),
+    'repository_languages': ('Repository', 'languages', 100, 'edges', LANGUAGE_EDGES, fragments.LANGUAGE),
+    'repository_assignable_users': ('Repository', 'assignableUsers', 100, 'nodes', USER_NODES, fragments.USER),
+    'repository_collaborators': ('Repository', 'collaborators', 100, 'nodes', USER_NODES, fragments.USER),
+    'repository_stargazers': ('Repository', 'stargazers', 100, 'nodes', USER_NODES, fragments.USER),
+    'repository_commit_comments': ('Repository', 'commitComments', 100, 'nodes', COMMIT_COMMENT_NODES,
+                                   fragments.COMMIT_COMMENT),
+    'repository_releases': ('Repository', 'releases', 100, 'nodes', RELEASE_NODES, fragments.RELEASE),
+    'repository_issues': ('Repository', 'issues', 100, 'nodes', ISSUE_NODES, fragments.ISSUE),
+    'repository_milestones': ('Repository', 'milestones', 100, 'nodes', MILESTONE_NODES, fragments.MILESTONES),
+    'repository_pull_requests': ('Repository', 'pullRequests', 16, 'nodes', PULL_REQUEST_NODES,
+                                 fragments.PULL_REQUEST),
+    'user_commit_comments': ('User', 'commitComments', 100, 'nodes', COMMIT_COMMENT_NODES, fragments.COMMIT_COMMENT),
+    'user_followers': ('User', 'followers', 100, 'nodes', USER_NODES, fragments.USER),
+    'user_following': ('User', 'following', 100, 'nodes', USER_NODES, fragments.USER),
+    'user_issues': ('User', 'issues', 100, 'nodes', ISSUE_NODES, fragments.ISSUE),
+    'user_pull_requests': ('User', 'pullRequests', 100, 'nodes', PULL_REQUEST_NODES, fragments.PULL_REQUEST),
+    'user_repositories': ('User', 'repositories', 100, 'nodes', REPOSITORY_NODES, fragments.REPOSITORY),
+    'user_repositories_contributed_to': ('User', 'repositoriesContributedTo', 100, 'nodes', REPOSITORY_NODES,
+                                         fragments.REPOSITORY),
+    'user_watching': ('User', 'watching', 100, 'nodes', REPOSITORY_NODES, fragments.REPOSITORY),
+}
@@ -0,0 +1,78 @@
+"""Crawl schedulers ranking nodes waiting in the frontier."""
+
+import math
+from collections import Counter
+
+FORK_COUNT = 'forkCount'
+
+
+class Scheduler:
+    """Scores newly discovered nodes and limits how many nodes of every label are taken.
+
+    Quotas count over the whole crawl of the process, so they cap what a crawl spends on every label under a
+    fixed API budget. The frontier hands out nodes by descending `score + degree_weight * times seen`, so the
+    base scheduler keeps discovery order.
+    """
+
+    degree_weight = 0.0
+
+    def __init__(self, quotas=None):
+        super().__init__()
+        self.quotas = quotas or {}
+        self._taken = Counter()
+
+    def score(self, label, properties, depth):
+        return 0.0
+
+    def start(self):
+        """Called at the start of every iteration, quotas are not reset."""
+
+    def take(self, label):
+        self._taken[label] += 1
+
+    def remaining(self):
+        return {label: quota - self._taken[label] for label, quota in self.quotas.items()}
+
+    def exhausted(self):
+        """Labels whose quota is used up."""
+        return [label for label, left in self.remaining().items() if left <= 0]
+
+
+class PopularityScheduler(Scheduler):
+    """Prefers repositories with many forks."""
+
+    def score(self, label, properties, depth):
+        return math.log1p(properties.get(FORK_COUNT) or 0)
+
+
+class DegreeScheduler(Scheduler):
+    """Prefers nodes discovered from many other nodes."""
+
+    degree_weight = 1.0
+
+
+class DistanceScheduler(Scheduler):
+    """Prefers nodes close to the seeds."""
+
+    def score(self, label, properties, depth):
+        return -float(depth)
+
+
+class CallableScheduler(Scheduler):
+    """Scores nodes with a user defined `function(label, properties, depth)`."""
+
+    def __init__(self, function, quotas=None, degree_weight=0.0):
+        super().__init__(quotas)
+        self.function = function
+        self.degree_weight = degree_weight
+
+    def score(self, label, properties, depth):
+        return self.function(label, properties, depth)
+
+
+SCHEDULERS = {
+    'fifo': Scheduler,
+    'popularity': PopularityScheduler,
+    'degree': DegreeScheduler,
+    'distance': DistanceScheduler,
+}
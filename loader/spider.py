@@ -1,90 +1,103 @@
 """GitHub graph crawler."""
 
+import asyncio
 import logging
+import threading
 import time
 import traceback
 from concurrent import futures
-from itertools import chain
 
-from gremlin_python.process.graph_traversal import GraphTraversal, __
-from gremlin_python.process.traversal import P
 from timeout_decorator import timeout
-from tqdm import tqdm
 
-from loader.github import GitHub
-
-URI = '_uri'
-TIME_CREATED = '_created'
-TIME_PROCESSED = '_processed'
-ERROR = '_error'
-ERROR_TRACE = '_error_trace'
+from loader.github import GitHub, BATCH_SIZE
+from loader.idcache import IdCache
+from loader.metrics import Progress
+from loader.scheduler import Scheduler
+from loader.storage import Storage, URI
+
+RELATIVES_TIMEOUT = 600
+WRITE_BATCH_SIZE = 100
+
+# (connection, relative label, edge label, reverse edge)
+REPOSITORY_RELATIVES = [
+    # ('repository_forks', 'repository', 'fork', False),
+    ('repository_assignable_users', 'user', 'assignable', False),
+    # Must have access for collaborators...
+    # ('repository_collaborators', 'user', 'collaborator', False),
+    ('repository_stargazers', 'user', 'stargazer', False),
+    ('repository_commit_comments', 'commit-comment', 'contains', False),
+    ('repository_releases', 'release', 'contains', False),
+    ('repository_issues', 'issue', 'contains', False),
+    ('repository_milestones', 'milestone', 'contains', False),
+    ('repository_languages', 'language', 'uses', False),
+]
+
+USER_RELATIVES = [
+    ('user_followers', 'user', 'follows', True),
+    ('user_following', 'user', 'follows', False),
+    ('user_commit_comments', 'commit-comment', 'wrote', False),
+    ('user_issues', 'issue', 'wrote', False),
+    ('user_repositories', 'repository', 'created', False),
+    ('user_repositories_contributed_to', 'repository', 'contributed-to', False),
+    ('user_watching', 'repository', 'watches', False),
+]
+
+# these often cause 502s, so they are only crawled on request, best with a planner shrinking their pages
+REPOSITORY_PULL_REQUESTS = [('repository_pull_requests', 'pull', 'contains', False)]
+USER_PULL_REQUESTS = [('user_pull_requests', 'pull', 'created', False)]
 
 
 class Spider:
-    def __init__(self, g: GraphTraversal, github: GitHub, relatives_limit, max_property_size, tokens):
+    def __init__(self, storage: Storage, github: GitHub, relatives_limit, max_property_size, batch_size=BATCH_SIZE,
+                 write_batch_size=WRITE_BATCH_SIZE, id_cache=None, frontier=None, scheduler=None, journal=None,
+                 pull_requests=False, metrics=None):
         super().__init__()
         self.github = github
-        self.g = g
+        self.storage = storage
         self.relatives_limit = relatives_limit
         self.max_property_size = max_property_size
-        self.tokens = tokens
-
-    def _get_or_create_node(self, label:str, uri:str):
-        return self.g.V().has(URI, uri).hasLabel(label).fold().coalesce(
-            __.unfold(),
-            __.addV(label).property(URI, uri)
-        )
-
-    def _get_or_created_edge_from(self, node: GraphTraversal, other: int, label: str):
-        return node.coalesce(
-            __.inE(label).filter(__.outV().hasId(other)),
-            __.addE(label).from_(self.g.V(other))
-        )
-
-    def _get_or_created_edge_to(self, node: GraphTraversal, other: int, label: str):
-        return node.coalesce(
-            __.outE(label).filter(__.inV().hasId(other)),
-            __.addE(label).to(self.g.V(other))
-        )
+        self.batch_size = batch_size
+        self.write_batch_size = write_batch_size
+        self.id_cache = IdCache() if id_cache is None else id_cache
+        self.frontier = frontier
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        self.journal = journal
+        self.metrics = github.metrics if metrics is None else metrics
+        self.repository_relatives = REPOSITORY_RELATIVES + (REPOSITORY_PULL_REQUESTS if pull_requests else [])
+        self.user_relatives = USER_RELATIVES + (USER_PULL_REQUESTS if pull_requests else [])
 
     def _get_node_id(self, uri:str):
-        nodes = self.g.V().has(URI, uri).id().toList()
-        assert len(nodes) <= 1
+        node_id = self.id_cache.get(uri)
+        if node_id is not None:
+            return node_id
 
-        if nodes:
-            return nodes[0]
-        return None
+        with self.metrics.time('lookup', op='node_id'):
+            node_id = self.storage.node_id(uri)
+        if node_id is not None:
+            self.id_cache.put(uri, node_id)
+        return node_id
 
-    def _add_properties(self, element, properties):
+    def _check_properties(self, properties):
         if properties is not None:
-            for key, value in properties.items():
+            for value in properties.values():
                 if hasattr(value, '__len__') and len(value) > self.max_property_size:
                     raise ValueError('Property exceded length limit.')
-                if value is not None:
-                    element = element.property(key, value)
-        return element
-
-    def _merge_node(self, label:str, properties: dict):
-        assert URI not in properties
-        assert 'id' in properties
-
-        uri = properties.pop('id')
+        return properties
 
-        # assert self.g.V().has(URI, uri).count().next() <= 1
-        vertex = self._get_or_create_node(label, uri)
-
-        vertex.property(TIME_CREATED, time.time())
-        vertex.property(TIME_PROCESSED, 0.0)
-        vertex = self._add_properties(vertex, properties)
-
-        return vertex
+    def _relatives_timeout(self):
+        # signal based timeouts are only available in the main thread
+        if threading.current_thread() is threading.main_thread():
+            return RELATIVES_TIMEOUT
+        return None
 
-    def _mark_processed(self, node_id: int):
-        self.g.V(node_id).property(TIME_PROCESSED, time.time()).next()
+    def _merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge, depth):
+        """Upserts a batch of relatives with their edges, returning a future of their uris and ids.
 
-    @timeout(600)
-    def _process_relatives(self, parent_id, relatives, label, edge_label, reverse_edge=False):
-        fs = []
+        Relatives with a cached id skip the vertex lookup, but are merged like any other. Also returns scheduler
+        priorities of the relatives by uri, as all of them are left to process again.
+        """
+        merged = {}
+        writes = []
         for relative in relatives:
             if 'node' in relative:
                 edge_props = relative
@@ -92,86 +105,108 @@ class Spider:
             else:
                 edge_props = None
 
-            relative_node = self._merge_node(label, relative)
-
-            if reverse_edge:
-                edge = self._get_or_created_edge_from(relative_node, parent_id, edge_label)
-            else:
-                edge = self._get_or_created_edge_to(relative_node, parent_id, edge_label)
-
-            fs.append(self._add_properties(edge, edge_props).promise())
+            assert URI not in relative
+            uri = relative.pop('id')
+            relative_id = self.id_cache.get(uri)
+            merged[uri] = self.scheduler.score(label, relative, depth)
+            writes.append((uri, relative_id, self._check_properties(relative), self._check_properties(edge_props)))
 
-        futures.wait(fs)
+        return self.storage.merge_relatives(parent_id, writes, label, edge_label, reverse_edge), merged
 
-    def _process_repository(self, uri:str):
-        node_id = self._get_node_id(uri)
+    @timeout(RELATIVES_TIMEOUT)
+    def _process_relatives(self, parent_id, relatives, label, edge_label, reverse_edge=False, depth=0):
+        relatives = list(relatives)
 
-        # self._process_relatives(node_id, self.github.get_repository_forks(uri, self.relatives_limit),
-        #                         'repository', 'fork')
-        self._process_relatives(node_id, self.github.get_repository_assignable_users(uri, self.relatives_limit),
-                                'user', 'assignable')
-        # Must have access for collaborators...
-        # self._process_relatives(node_id, self.github.get_repository_collaborators(uri, self.relatives_limit),
-        #                         'user', 'collaborator')
-        self._process_relatives(node_id, self.github.get_repository_stargazers(uri, self.relatives_limit),
-                                'user', 'stargazer')
-
-        self._process_relatives(node_id, self.github.get_repository_commit_comments(uri, self.relatives_limit),
-                                'commit-comment', 'contains')
-        self._process_relatives(node_id, self.github.get_repository_releases(uri, self.relatives_limit),
-                                'release', 'contains')
-        self._process_relatives(node_id, self.github.get_repository_issues(uri, self.relatives_limit),
-                                'issue', 'contains')
-        self._process_relatives(node_id, self.github.get_repository_milestones(uri, self.relatives_limit),
-                                'milestone', 'contains')
-        # TODO these often causes 502
-        # self._process_relatives(node_id, self.github.get_repository_pull_requests(uri, self.relatives_limit), 'pull', 'contains')
-
-        self._process_relatives(node_id, self.github.get_repository_languages(uri, self.relatives_limit), 'language', 'uses')
-
-        self._mark_processed(node_id)
-
-    def _process_user(self, uri:str):
+        fs = []
+        merged = {}
+        with self.metrics.time('write', label=label, edge=edge_label):
+            for start in range(0, len(relatives), self.write_batch_size):
+                batch = relatives[start:start + self.write_batch_size]
+                future, batch_merged = self._merge_relatives(parent_id, batch, label, edge_label, reverse_edge,
+                                                             depth)
+                fs.append(future)
+                merged.update(batch_merged)
+
+            futures.wait(fs)
+        self.metrics.count('relatives', len(relatives), label=label, edge=edge_label)
+
+        relative_ids = []
+        discovered = []
+        for f in fs:
+            for uri, relative_id in f.result():
+                self.id_cache.put(uri, relative_id)
+                relative_ids.append(relative_id)
+                discovered.append((label, uri, relative_id, merged[uri], depth))
+
+        if self.frontier is not None:
+            self.frontier.push_many(discovered)
+        return relative_ids
+
+    def _process_connections(self, uri:str, relatives, depth):
         node_id = self._get_node_id(uri)
 
-        self._process_relatives(node_id, self.github.get_user_followers(uri, self.relatives_limit),
-                                'user', 'follows', reverse_edge=True)
-        self._process_relatives(node_id, self.github.get_user_following(uri, self.relatives_limit),
-                                'user', 'follows')
-        self._process_relatives(node_id, self.github.get_user_commit_comments(uri, self.relatives_limit),
-                                'commit-comment', 'wrote')
-        self._process_relatives(node_id, self.github.get_user_issues(uri, self.relatives_limit),
-                                'issue', 'wrote')
-        # TODO these often causes 502
-        # self._process_relatives(node_id, self.github.get_user_pull_requests(uri, self.relatives_limit),
-        #                         'pull', 'created')
-        self._process_relatives(node_id, self.github.get_user_repositories(uri, self.relatives_limit),
-                                'repository', 'created')
-        self._process_relatives(node_id, self.github.get_user_repositories_contributed_to(uri, self.relatives_limit),
-                                'repository', 'contributed-to')
-        self._process_relatives(node_id, self.github.get_user_watching(uri, self.relatives_limit),
-                                'repository', 'watches')
-
-        self._mark_processed(node_id)
-
-    def _process_do_nothing(self, uri:str):
+        connections = {connection: (label, edge_label, reverse_edge)
+                       for connection, label, edge_label, reverse_edge in relatives}
+        # resume connections after the last page persisted before a crash or timeout
+        cursors = {} if self.journal is None else self.journal.cursors(uri)
+        requested = []
+        for connection in connections:
+            cursor, done = cursors.get(connection, (None, False))
+            if not done:
+                requested.append((uri, connection, cursor))
+
+        pages = self.github.get_batched_pages(requested, self.relatives_limit, self.batch_size)
+        for (_, connection), nodes, cursor, has_next in pages:
+            label, edge_label, reverse_edge = connections[connection]
+            self._process_relatives(node_id, nodes, label, edge_label, reverse_edge, depth + 1,
+                                    timeout=self._relatives_timeout())
+            if self.journal is not None:
+                self.journal.advance(uri, connection, cursor, has_next)
+
+        with self.metrics.time('write', op='processed'):
+            self.storage.mark_processed(node_id)
+        if self.journal is not None:
+            self.journal.clear(uri)
+
+    def _process_repository(self, uri:str, depth=0):
+        self._process_connections(uri, self.repository_relatives, depth)
+
+    def _process_user(self, uri:str, depth=0):
+        self._process_connections(uri, self.user_relatives, depth)
+
+    def _process_do_nothing(self, uri:str, depth=0):
         node_id = self._get_node_id(uri)
-        self._mark_processed(node_id)
+        with self.metrics.time('write', op='processed'):
+            self.storage.mark_processed(node_id)
 
     def load_repository(self, ghid_or_url):
-        return self._merge_node('repository', self.github.get_repository(ghid_or_url)).id().next()
-
-    def has_unprocessed(self):
-        return self.g.V().has(TIME_PROCESSED, 0.0).hasNext()
-
-    def process(self, change_limit, quiet=False, repos_first=True, skip_errors=True, token_checking_number=10):
-        start = time.time()
-        nodes_count = self.g.V().has(TIME_PROCESSED, 0.0).has(TIME_CREATED, P.lte(start)).count().next()
-
+        repository = self.github.get_repository(ghid_or_url)
+        uri = repository.pop('id')
+        node_id = self.storage.merge_node('repository', uri, self._check_properties(repository))
+        self.id_cache.put(uri, node_id)
+        if self.frontier is not None:
+            self.frontier.push('repository', uri, node_id, self.scheduler.score('repository', repository, 0))
+        return node_id
+
+    def rebuild_frontier(self):
+        """Fills the frontier with all unprocessed nodes of the graph."""
+        self.frontier.push_many((label, uri, node_id, 0.0, 0) for label, uri, node_id in self.storage.unprocessed_nodes())
+
+    def _log_id_cache(self, quiet):
+        stats = self.id_cache.stats()
+        for key, value in stats.items():
+            self.metrics.gauge('id_cache', value, stat=key)
         if not quiet:
-            logging.info('Starting iteration at {} with {}/{} nodes to process.'.format(start, nodes_count, self.g.V().count().next()))
+            logging.info('Id cache: {hits} hits, {misses} misses, {size} ids, {hit_rate:.1%} hit rate.'
+                         .format(**stats))
+
+    def has_unprocessed(self, skip_errors=False):
+        if self.frontier is not None:
+            return self.frontier.count(skip_errors=skip_errors, excluded_labels=self.scheduler.exhausted()) > 0
+        return self.storage.has_unprocessed(skip_errors)
 
-        processors = {
+    def _processors(self):
+        return {
             'repository': self._process_repository,
             'user': self._process_user,
             'language': self._process_do_nothing,
@@ -182,30 +217,89 @@ class Spider:
             'milestone': self._process_do_nothing,
         }
 
-        if repos_first:
-            repo_nodes = self.g.V().has(TIME_PROCESSED, 0.0).has(TIME_CREATED, P.lte(start)).hasLabel('repository')
-            other_nodes = self.g.V().has(TIME_PROCESSED, 0.0).has(TIME_CREATED, P.lte(start)).not_(__.hasLabel('repository'))
-            if skip_errors:
-                repo_nodes = repo_nodes.hasNot('_error')
-                other_nodes = other_nodes.hasNot('_error')
-            nodes = chain(repo_nodes, other_nodes)
+    def _unprocessed_nodes(self, quiet, repos_first, skip_errors):
+        start = time.time()
+
+        if self.frontier is not None:
+            nodes_count = self.frontier.count(start, skip_errors, self.scheduler.exhausted())
+            if not quiet:
+                logging.info('Starting iteration at {} with {}/{} nodes to process.'.format(start, nodes_count, len(self.frontier)))
+            self.scheduler.start()
+            return self.frontier.iterate(start, repos_first, skip_errors, self.scheduler), nodes_count
+
+        nodes_count = self.storage.count_unprocessed(start, skip_errors)
+
+        if not quiet:
+            logging.info('Starting iteration at {} with {}/{} nodes to process.'.format(start, nodes_count, self.storage.count()))
+
+        nodes = self.storage.unprocessed(start, repos_first, skip_errors)
+        return ((node, None, None, 0) for node in nodes), nodes_count
+
+    def _process_node(self, processors, node):
+        node_id, label, uri, depth = node
+        if label is None:
+            with self.metrics.time('lookup', op='node'):
+                label, uri = self.storage.node(node_id)
         else:
-            nodes = self.g.V().has(TIME_PROCESSED, 0.0).has(TIME_CREATED, P.lte(start))
-            if skip_errors:
-                nodes = nodes.hasNot('_error')
-
-        for n, node in enumerate(tqdm(nodes, total=nodes_count, unit='node', disable=quiet)):
-            label = self.g.V(node).label().next()
-            uri = self.g.V(node).properties(URI).value().next()
-
-            if n % token_checking_number == 0:
-                self.github.adjust_token(self.tokens, quiet, change_limit=change_limit)
-
-            try:
-                processors[label](uri)
-            except Exception as e:
-                logging.exception(e)
-                self.g.V(node)\
-                    .property(ERROR, str(e))\
-                    .property(ERROR_TRACE, traceback.format_exc())\
-                    .iterate()
+            self.id_cache.put(uri, node_id)
+
+        try:
+            with self.metrics.time('node', label=label):
+                processors[label](uri, depth)
+            self.metrics.count('nodes', label=label, outcome='processed')
+            if self.frontier is not None:
+                self.frontier.complete(uri)
+        except Exception as e:
+            logging.exception(e)
+            self.metrics.count('nodes', label=label, outcome='failed')
+            self.storage.mark_error(node_id, str(e), traceback.format_exc())
+            if self.frontier is not None:
+                self.frontier.fail(uri, str(e))
+
+    def process(self, quiet=False, repos_first=True, skip_errors=True):
+        nodes, nodes_count = self._unprocessed_nodes(quiet, repos_first, skip_errors)
+        processors = self._processors()
+
+        with Progress(self.metrics, nodes_count, quiet=quiet) as progress:
+            for node in nodes:
+                self._process_node(processors, node)
+                progress.update()
+
+        self._log_id_cache(quiet)
+
+    def process_async(self, concurrency, quiet=False, repos_first=True, skip_errors=True):
+        """Same as `process`, but keeps up to `concurrency` nodes in flight at once."""
+        nodes, nodes_count = self._unprocessed_nodes(quiet, repos_first, skip_errors)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._process_concurrently(nodes, nodes_count, concurrency, quiet))
+        finally:
+            loop.close()
+
+    async def _process_concurrently(self, nodes, nodes_count, concurrency, quiet):
+        # GitHub client and Gremlin driver are blocking, so fetches run on a thread pool driven by the event loop.
+        loop = asyncio.get_event_loop()
+        processors = self._processors()
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = set()
+
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor, \
+                Progress(self.metrics, nodes_count, quiet=quiet) as progress:
+
+            async def run(node):
+                try:
+                    await loop.run_in_executor(executor, self._process_node, processors, node)
+                finally:
+                    progress.update()
+                    semaphore.release()
+
+            for node in nodes:
+                await semaphore.acquire()
+                task = asyncio.ensure_future(run(node))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.wait(pending)
+
+        self._log_id_cache(quiet)
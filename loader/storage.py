@@ -0,0 +1,328 @@
+"""Graph storage backends of the spider."""
+
+import json
+import sqlite3
+import threading
+import time
+from concurrent import futures
+from itertools import chain
+
+from gremlin_python.process.graph_traversal import GraphTraversal, __
+from gremlin_python.process.traversal import P, T
+
+URI = '_uri'
+ID = 'id'
+LABEL = 'label'
+TIME_CREATED = '_created'
+TIME_PROCESSED = '_processed'
+ERROR = '_error'
+ERROR_TRACE = '_error_trace'
+
+
+class Storage:
+    """Graph operations the spider needs.
+
+    Nodes are identified by their GitHub `uri` and get a storage specific id when first merged. Merging a node
+    again refreshes its properties and marks it unprocessed, the same as the first time.
+    """
+
+    def node_id(self, uri):
+        """Id of the node of `uri`, `None` if there is none."""
+        raise NotImplementedError()
+
+    def node(self, node_id):
+        """`(label, uri)` of the node `node_id`."""
+        raise NotImplementedError()
+
+    def merge_node(self, label, uri, properties):
+        """Gets or creates the node of `uri`, sets its properties and returns its id."""
+        raise NotImplementedError()
+
+    def merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge):
+        """Merges `(uri, node_id, properties, edge_properties)` relatives and upserts their edges to the parent.
+
+        Every relative is merged like `merge_node` does, a known `node_id` only saves looking it up by uri and is
+        looked up again if it no longer belongs to the uri. Edges go from the relative to the parent, or the other
+        way round if `reverse_edge`. Returns a future of the `(uri, node_id)` of all relatives.
+        """
+        raise NotImplementedError()
+
+    def mark_processed(self, node_id):
+        raise NotImplementedError()
+
+    def mark_error(self, node_id, error, trace):
+        raise NotImplementedError()
+
+    def count(self):
+        raise NotImplementedError()
+
+    def count_unprocessed(self, before, skip_errors=False):
+        """Number of unprocessed nodes created before `before`."""
+        raise NotImplementedError()
+
+    def has_unprocessed(self, skip_errors=False):
+        raise NotImplementedError()
+
+    def unprocessed(self, before, repos_first=True, skip_errors=False):
+        """Ids of unprocessed nodes created before `before`, repositories first if `repos_first`."""
+        raise NotImplementedError()
+
+    def unprocessed_nodes(self):
+        """`(label, uri, node_id)` of all unprocessed nodes."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class GremlinStorage(Storage):
+    """Graph in a Gremlin server such as JanusGraph, written with one traversal per batch of relatives."""
+
+    def __init__(self, g: GraphTraversal):
+        super().__init__()
+        self.g = g
+
+    def _get_or_create_node(self, label:str, uri:str, source=None, node_id=None):
+        source = self.g if source is None else source
+        if node_id is not None:
+            # a cached id of a vertex removed since, or of another graph, falls back to the lookup by uri
+            return source.V(node_id).has(URI, uri).fold().coalesce(
+                __.unfold(),
+                self._get_or_create_node(label, uri, __)
+            )
+        return source.V().has(URI, uri).hasLabel(label).fold().coalesce(
+            __.unfold(),
+            __.addV(label).property(URI, uri)
+        )
+
+    def _get_or_created_edge_from(self, node: GraphTraversal, other: int, label: str):
+        return node.coalesce(
+            __.inE(label).filter(__.outV().hasId(other)),
+            __.addE(label).from_(__.V(other))
+        )
+
+    def _get_or_created_edge_to(self, node: GraphTraversal, other: int, label: str):
+        return node.coalesce(
+            __.outE(label).filter(__.inV().hasId(other)),
+            __.addE(label).to(__.V(other))
+        )
+
+    def _add_properties(self, element, properties):
+        if properties is not None:
+            for key, value in properties.items():
+                if value is not None:
+                    element = element.property(key, value)
+        return element
+
+    def _merge_node(self, label, uri, properties, source=None, node_id=None):
+        vertex = self._get_or_create_node(label, uri, source, node_id)
+
+        vertex.property(TIME_CREATED, time.time())
+        vertex.property(TIME_PROCESSED, 0.0)
+        return self._add_properties(vertex, properties)
+
+    def node_id(self, uri):
+        nodes = self.g.V().has(URI, uri).id().toList()
+        assert len(nodes) <= 1
+        return nodes[0] if nodes else None
+
+    def node(self, node_id):
+        node = self.g.V(node_id).project(LABEL, URI).by(T.label).by(URI).next()
+        return node[LABEL], node[URI]
+
+    def merge_node(self, label, uri, properties):
+        return self._merge_node(label, uri, properties).id().next()
+
+    def merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge):
+        branches = []
+        for uri, relative_id, properties, edge_properties in relatives:
+            if reverse_edge:
+                edge = self._get_or_created_edge_from(__.identity(), parent_id, edge_label)
+            else:
+                edge = self._get_or_created_edge_to(__.identity(), parent_id, edge_label)
+
+            relative_node = self._merge_node(label, uri, properties, __, relative_id)
+            branches.append(relative_node.sideEffect(self._add_properties(edge, edge_properties))
+                            .project(URI, ID).by(URI).by(T.id))
+
+        return self.g.inject(parent_id).union(*branches)\
+            .promise(lambda t: [(relative[URI], relative[ID]) for relative in t.toList()])
+
+    def mark_processed(self, node_id):
+        self.g.V(node_id).property(TIME_PROCESSED, time.time()).next()
+
+    def mark_error(self, node_id, error, trace):
+        self.g.V(node_id)\
+            .property(ERROR, error)\
+            .property(ERROR_TRACE, trace)\
+            .iterate()
+
+    def count(self):
+        return self.g.V().count().next()
+
+    def _unprocessed(self, before, skip_errors):
+        nodes = self.g.V().has(TIME_PROCESSED, 0.0).has(TIME_CREATED, P.lte(before))
+        if skip_errors:
+            nodes = nodes.hasNot(ERROR)
+        return nodes
+
+    def count_unprocessed(self, before, skip_errors=False):
+        return self._unprocessed(before, skip_errors).count().next()
+
+    def has_unprocessed(self, skip_errors=False):
+        nodes = self.g.V().has(TIME_PROCESSED, 0.0)
+        if skip_errors:
+            nodes = nodes.hasNot(ERROR)
+        return nodes.hasNext()
+
+    def unprocessed(self, before, repos_first=True, skip_errors=False):
+        if repos_first:
+            return chain(self._unprocessed(before, skip_errors).hasLabel('repository').id(),
+                         self._unprocessed(before, skip_errors).not_(__.hasLabel('repository')).id())
+        return self._unprocessed(before, skip_errors).id()
+
+    def unprocessed_nodes(self):
+        nodes = self.g.V().has(TIME_PROCESSED, 0.0).project(ID, LABEL, URI).by(T.id).by(T.label).by(URI)
+        return ((node[LABEL], node[URI], node[ID]) for node in nodes)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    uri TEXT NOT NULL UNIQUE,
+    label TEXT NOT NULL,
+    properties TEXT NOT NULL DEFAULT '{}',
+    created REAL NOT NULL,
+    processed REAL NOT NULL DEFAULT 0.0,
+    error TEXT,
+    error_trace TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_unprocessed ON nodes (processed, created);
+CREATE TABLE IF NOT EXISTS edges (
+    source INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    properties TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (source, target, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edges_target ON edges (target, label);
+"""
+
+
+def _properties(properties):
+    return json.dumps({key: value for key, value in (properties or {}).items() if value is not None})
+
+
+class SqliteStorage(Storage):
+    """Graph in a local SQLite file, for crawls too small to need a graph database.
+
+    Properties of nodes and edges are kept as JSON objects. Each batch of relatives is written in a single
+    transaction, so merges return already completed futures.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60.0, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def _query(self, query, parameters=()):
+        with self._lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def _merge_nodes(self, nodes):
+        """Upserts `(uri, label, properties)` nodes and returns their ids by uri."""
+        now = time.time()
+        self._db.executemany("""
+            INSERT INTO nodes (uri, label, properties, created) VALUES (?, ?, ?, ?)
+            ON CONFLICT (uri) DO UPDATE SET
+                properties = json_patch(properties, excluded.properties),
+                created = excluded.created,
+                processed = 0.0
+        """, [(uri, label, _properties(properties), now) for uri, label, properties in nodes])
+
+        ids = {}
+        uris = [uri for uri, _, _ in nodes]
+        for start in range(0, len(uris), 500):
+            batch = uris[start:start + 500]
+            ids.update(self._db.execute('SELECT uri, id FROM nodes WHERE uri IN ({})'.format(
+                ', '.join('?' * len(batch))), batch).fetchall())
+        return ids
+
+    def _transaction(self, function, *args):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(*args)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return result
+
+    def node_id(self, uri):
+        rows = self._query('SELECT id FROM nodes WHERE uri = ?', (uri,))
+        return rows[0][0] if rows else None
+
+    def node(self, node_id):
+        return tuple(self._query('SELECT label, uri FROM nodes WHERE id = ?', (node_id,))[0])
+
+    def merge_node(self, label, uri, properties):
+        return self._transaction(self._merge_nodes, [(uri, label, properties)])[uri]
+
+    def _merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge):
+        # uris are indexed, so relatives are upserted by uri and cached ids of a recreated file cannot dangle
+        ids = self._merge_nodes([(uri, label, properties) for uri, _, properties, _ in relatives])
+
+        edges = []
+        for uri, _, _, edge_properties in relatives:
+            source, target = (parent_id, ids[uri]) if reverse_edge else (ids[uri], parent_id)
+            edges.append((source, target, edge_label, _properties(edge_properties)))
+        self._db.executemany("""
+            INSERT INTO edges (source, target, label, properties) VALUES (?, ?, ?, ?)
+            ON CONFLICT (source, target, label) DO UPDATE SET properties = json_patch(properties, excluded.properties)
+        """, edges)
+        return [(uri, ids[uri]) for uri, _, _, _ in relatives]
+
+    def merge_relatives(self, parent_id, relatives, label, edge_label, reverse_edge):
+        future = futures.Future()
+        future.set_result(self._transaction(self._merge_relatives, parent_id, relatives, label, edge_label,
+                                            reverse_edge))
+        return future
+
+    def mark_processed(self, node_id):
+        self._query('UPDATE nodes SET processed = ? WHERE id = ?', (time.time(), node_id))
+
+    def mark_error(self, node_id, error, trace):
+        self._query('UPDATE nodes SET error = ?, error_trace = ? WHERE id = ?', (error, trace, node_id))
+
+    def count(self):
+        return self._query('SELECT count(*) FROM nodes')[0][0]
+
+    def _where(self, skip_errors):
+        where = 'processed = 0.0 AND created <= ?'
+        if skip_errors:
+            where += ' AND error IS NULL'
+        return where
+
+    def count_unprocessed(self, before, skip_errors=False):
+        return self._query('SELECT count(*) FROM nodes WHERE ' + self._where(skip_errors), (before,))[0][0]
+
+    def has_unprocessed(self, skip_errors=False):
+        return self.count_unprocessed(float('inf'), skip_errors) > 0
+
+    def unprocessed(self, before, repos_first=True, skip_errors=False):
+        order = "label != 'repository', id" if repos_first else 'id'
+        rows = self._query('SELECT id FROM nodes WHERE {} ORDER BY {}'.format(self._where(skip_errors), order),
+                           (before,))
+        return (node_id for node_id, in rows)
+
+    def unprocessed_nodes(self):
+        return self._query('SELECT label, uri, id FROM nodes WHERE processed = 0.0')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,73 @@
+"""GitHub token pool scheduled by remaining rate limit."""
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+RATE_LIMIT = 5000
+RESERVE = 400
+# seconds to wait for a reset of a token GitHub did not tell the reset time of
+RESET_WAIT = 60.0
+
+
+def _timestamp(reset_at):
+    return datetime.strptime(reset_at, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenPool:
+    """Tracks the rate limit budget of every token from `rateLimit` piggybacked on queries.
+
+    Requests are always dispatched to the token with the most points remaining. When every token is down to
+    `reserve` points `acquire` sleeps until the earliest `resetAt`.
+    """
+
+    def __init__(self, tokens, reserve=RESERVE, quiet=False):
+        super().__init__()
+        if reserve >= RATE_LIMIT:
+            raise ValueError('Reserve {} leaves nothing of the rate limit {} to use.'.format(reserve, RATE_LIMIT))
+        self.tokens = list(tokens)
+        self.reserve = reserve
+        self.quiet = quiet
+        self._remaining = {token: RATE_LIMIT for token in self.tokens}
+        self._reset_at = {token: 0.0 for token in self.tokens}
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        for token in self.tokens:
+            if self._reset_at[token] and self._reset_at[token] <= now:
+                self._remaining[token] = RATE_LIMIT
+                self._reset_at[token] = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refresh(now)
+                token = max(self.tokens, key=self._remaining.get)
+                if self._remaining[token] > self.reserve:
+                    return token
+                wake_up = min((reset_at for reset_at in self._reset_at.values() if reset_at), default=now + RESET_WAIT)
+
+            if not self.quiet:
+                logging.info('All tokens drained, sleeping {:.0f}s until {}.'.format(
+                    wake_up - now, datetime.fromtimestamp(wake_up, timezone.utc).isoformat()))
+            time.sleep(max(wake_up - now, 0.0) + 1.0)
+
+    def name(self, token):
+        """Name of `token` safe to log."""
+        return 'token-{}'.format(self.tokens.index(token))
+
+    def update(self, token, rate):
+        with self._lock:
+            self._remaining[token] = rate['remaining']
+            self._reset_at[token] = _timestamp(rate['resetAt'])
+
+    def exhaust(self, token, reset_at=None):
+        with self._lock:
+            self._remaining[token] = 0
+            self._reset_at[token] = reset_at or self._reset_at[token] or time.time() + RESET_WAIT
+
+    def remaining(self):
+        with self._lock:
+            return dict(self._remaining)
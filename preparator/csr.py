@@ -0,0 +1,214 @@
+"""Memory-mapped CSR store of the crawled graph."""
+
+import json
+import os
+
+import numpy as np
+
+METADATA = 'graph.json'
+URIS = 'uris.npy'
+URI_VERTICES = 'uri_vertices.npy'
+URI_RANKS = 'uri_ranks.npy'
+LABELS = 'labels.npy'
+EDGES = 'edges'
+COLUMNS = 'columns'
+OUT = 'out'
+IN = 'in'
+
+NUMERIC = 'numeric'
+STRING = 'string'
+
+
+def _csr(sources, targets, sizes, n):
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return offsets, targets[order], sizes[order]
+
+
+def _is_numeric(values):
+    return all(isinstance(value, (bool, int, float, np.number, np.bool_)) for value in values)
+
+
+def _write_column(path, name, n, indices, values):
+    indices = np.asarray(indices, dtype=np.int64)
+    prefix = os.path.join(path, COLUMNS, name + '.')
+
+    if _is_numeric(values):
+        column = np.full(n, np.nan)
+        column[indices] = np.asarray(values, dtype=np.float64)
+        np.save(prefix + 'values.npy', column)
+        return NUMERIC
+
+    encoded = [str(value).encode('utf-8') for value in values]
+    lengths = np.zeros(n, dtype=np.int64)
+    lengths[indices] = [len(value) for value in encoded]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    present = np.zeros(n, dtype=bool)
+    present[indices] = True
+
+    data = np.zeros(offsets[-1], dtype=np.uint8)
+    for index, value in zip(indices, encoded):
+        data[offsets[index]:offsets[index + 1]] = np.frombuffer(value, dtype=np.uint8)
+
+    np.save(prefix + 'offsets.npy', offsets)
+    np.save(prefix + 'data.npy', data)
+    np.save(prefix + 'present.npy', present)
+    return STRING
+
+
+def write_graph(path, uris, label_names, labels, edges, columns):
+    """Writes a graph of `len(uris)` vertices numbered by their position into `path`.
+
+    `labels` holds the code of every vertex label in `label_names`, `edges` maps an edge label to its
+    `(sources, targets, sizes)` vertex index arrays and `columns` maps a property to the `(indices, values)` of the
+    vertices having it. Properties with only numbers or booleans become float columns with NaN where missing, the
+    others become UTF-8 string columns.
+    """
+    n = len(uris)
+    os.makedirs(os.path.join(path, EDGES), exist_ok=True)
+    os.makedirs(os.path.join(path, COLUMNS), exist_ok=True)
+
+    encoded = np.array([uri.encode('utf-8') for uri in uris], dtype=bytes) if n else np.zeros(0, dtype='S1')
+    order = np.argsort(encoded, kind='stable')
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(n)
+    np.save(os.path.join(path, URIS), encoded[order])
+    np.save(os.path.join(path, URI_VERTICES), order.astype(np.int64))
+    np.save(os.path.join(path, URI_RANKS), ranks)
+    np.save(os.path.join(path, LABELS), np.asarray(labels, dtype=np.int32))
+
+    for label, (sources, targets, sizes) in edges.items():
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        sizes = np.asarray(sizes, dtype=np.float64)
+        for direction, (start, end) in ((OUT, (sources, targets)), (IN, (targets, sources))):
+            offsets, neighbours, neighbour_sizes = _csr(start, end, sizes, n)
+            prefix = os.path.join(path, EDGES, '{}.{}.'.format(label, direction))
+            np.save(prefix + 'offsets.npy', offsets)
+            np.save(prefix + 'targets.npy', neighbours)
+            np.save(prefix + 'sizes.npy', neighbour_sizes)
+
+    column_types = {name: _write_column(path, name, n, indices, values)
+                    for name, (indices, values) in columns.items()}
+
+    with open(os.path.join(path, METADATA), 'w') as file:
+        json.dump({'vertices': n, 'labels': list(label_names), 'edge_labels': sorted(edges),
+                   'columns': column_types}, file)
+
+
+def _load(path):
+    return np.load(path, mmap_mode='r')
+
+
+class StringColumn:
+    """UTF-8 strings of a property stored back to back, `None` where the vertex does not have it."""
+
+    def __init__(self, offsets, data, present):
+        super().__init__()
+        self.offsets = offsets
+        self.data = data
+        self.present = present
+
+    def __len__(self):
+        return len(self.present)
+
+    def _value(self, vertex):
+        if not self.present[vertex]:
+            return None
+        return self.data[self.offsets[vertex]:self.offsets[vertex + 1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, vertices):
+        if np.ndim(vertices) == 0:
+            return self._value(vertices)
+        values = np.empty(len(vertices), dtype=object)
+        values[:] = [self._value(vertex) for vertex in vertices]
+        return values
+
+
+class CsrGraph:
+    """Graph written by `write_graph`, memory-mapped so it opens without reading the arrays.
+
+    Vertices are integers. Neighbours of a vertex are a slice of the targets array of the edge label, so
+    neighbour and degree queries neither copy nor load more than the pages they touch.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(os.path.join(path, METADATA)) as file:
+            metadata = json.load(file)
+
+        self.vertices = metadata['vertices']
+        self.label_names = metadata['labels']
+        self.edge_labels = metadata['edge_labels']
+        self.column_types = metadata['columns']
+
+        self.labels = _load(os.path.join(path, LABELS))
+        self.uris = _load(os.path.join(path, URIS))
+        self.uri_vertices = _load(os.path.join(path, URI_VERTICES))
+        self.uri_ranks = _load(os.path.join(path, URI_RANKS))
+        self._adjacency = {}
+        self._columns = {}
+
+    def __len__(self):
+        return self.vertices
+
+    def label(self, name):
+        """Code of the vertex label `name`, -1 if no vertex has it."""
+        return self.label_names.index(name) if name in self.label_names else -1
+
+    def index(self, uri):
+        """Vertex of `uri`, -1 if there is none."""
+        key = uri.encode('utf-8')
+        rank = np.searchsorted(self.uris, key)
+        if rank < len(self.uris) and self.uris[rank] == key:
+            return int(self.uri_vertices[rank])
+        return -1
+
+    def uri(self, vertex):
+        return self.uris[self.uri_ranks[vertex]].decode('utf-8')
+
+    def adjacency(self, label, direction=OUT):
+        """`(offsets, targets, sizes)` of `label` edges, empty arrays if there are none."""
+        key = (label, direction)
+        if key not in self._adjacency:
+            if label in self.edge_labels:
+                prefix = os.path.join(self.path, EDGES, '{}.{}.'.format(label, direction))
+                self._adjacency[key] = tuple(_load(prefix + name)
+                                             for name in ('offsets.npy', 'targets.npy', 'sizes.npy'))
+            else:
+                empty = np.zeros(0, dtype=np.int64)
+                self._adjacency[key] = np.zeros(len(self) + 1, dtype=np.int64), empty, empty.astype(np.float64)
+        return self._adjacency[key]
+
+    def neighbours(self, label, vertex, direction=OUT):
+        offsets, targets, _ = self.adjacency(label, direction)
+        return targets[offsets[vertex]:offsets[vertex + 1]]
+
+    def sizes(self, label, vertex, direction=OUT):
+        """`size` of the `label` edges of `vertex` in the order of its `neighbours`."""
+        offsets, _, sizes = self.adjacency(label, direction)
+        return sizes[offsets[vertex]:offsets[vertex + 1]]
+
+    def degree(self, label, vertex, direction=OUT):
+        offsets, _, _ = self.adjacency(label, direction)
+        return int(offsets[vertex + 1] - offsets[vertex])
+
+    def degrees(self, label, direction=OUT):
+        offsets, _, _ = self.adjacency(label, direction)
+        return np.diff(offsets)
+
+    def column(self, name):
+        """Float array or `StringColumn` of the property `name`, all NaN if no vertex has it."""
+        if name not in self._columns:
+            prefix = os.path.join(self.path, COLUMNS, name + '.')
+            column_type = self.column_types.get(name)
+            if column_type == NUMERIC:
+                self._columns[name] = _load(prefix + 'values.npy')
+            elif column_type == STRING:
+                self._columns[name] = StringColumn(*(_load(prefix + part)
+                                                     for part in ('offsets.npy', 'data.npy', 'present.npy')))
+            else:
+                self._columns[name] = np.full(len(self), np.nan)
+        return self._columns[name]
@@ -0,0 +1,143 @@
+"""Vectorized computation of repository features from a graph snapshot."""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from tqdm import tqdm
+
+from preparator.export import CHUNK_SIZE
+from preparator.csr import StringColumn, IN, OUT
+from preparator.languages import Vocabulary
+from preparator.snapshot import Snapshot
+from preparator.stats import ColumnBuffer, ASSIGNABLE, ASSIGNABLE_PREFIX, BIO, CLOSED, COMPANY, CONTAINS, \
+    CONTRIBUTED_TO, CREATED, FOLLOWS, IS_DRAFT, IS_PRERELEASE, MILESTONE, NAME, RELEASE, REPOSITORY, STARGAZER, \
+    STARGAZER_PREFIX, TIME_PROCESSED, UNCLOSED_ISSUES, UNDERSCORE, USES, WATCHES, WROTE
+
+
+def _segment_sums(offsets, values, rows):
+    """Sums of `values` over the CSR segments of `rows`."""
+    sums = np.zeros(len(values) + 1, dtype=np.float64)
+    np.cumsum(values, out=sums[1:])
+    return sums[offsets[rows + 1]] - sums[offsets[rows]]
+
+
+def _flag(column, value):
+    return np.asarray(column) == float(value)
+
+
+def _present(column):
+    if isinstance(column, StringColumn):
+        return np.asarray(column.present)
+    return ~np.isnan(column)
+
+
+class Engine:
+    """Computes the rows of `Stats` from a `Snapshot` with array operations instead of Gremlin queries."""
+
+    def __init__(self, snapshot: Snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+        self.labels = snapshot.labels
+
+    def repositories(self):
+        """Vertex indices of processed repositories."""
+        processed = np.nan_to_num(self.snapshot.column(TIME_PROCESSED))
+        return np.flatnonzero((self.labels == self.snapshot.label(REPOSITORY)) & (processed > 0.0))
+
+    def _in_degree(self, label, rows):
+        return self.snapshot.degrees(label, IN)[rows].astype(np.float64)
+
+    def _out_degree(self, label, rows):
+        return self.snapshot.degrees(label, OUT)[rows].astype(np.float64)
+
+    def _in_sources(self, label, rows, mask):
+        """Number of `label` in-edges of `rows` whose source vertex is in `mask`."""
+        offsets, sources, _ = self.snapshot.adjacency(label, IN)
+        return _segment_sums(offsets, mask[sources], rows)
+
+    def _any_in_sources(self, rows, mask):
+        counts = np.zeros(len(rows))
+        for label in self.snapshot.edge_labels:
+            counts += self._in_sources(label, rows, mask)
+        return counts
+
+    def _counts(self, rows):
+        snapshot = self.snapshot
+        is_label = {name: self.labels == snapshot.label(name) for name in (MILESTONE, RELEASE)}
+        closed = _flag(snapshot.column(CLOSED), True)
+        open_ = _flag(snapshot.column(CLOSED), False)
+        bio = _present(snapshot.column(BIO))
+        company = _present(snapshot.column(COMPANY))
+
+        contributors_offsets, contributors, _ = snapshot.adjacency(CONTRIBUTED_TO, OUT)
+
+        def contributors_sum(values):
+            return _segment_sums(contributors_offsets, values[contributors], rows)
+
+        # has(BIO)/has(COMPANY) of the assignable and stargazer features filter edges, which carry neither
+        zeros = np.zeros(len(rows))
+
+        return [
+            (UNCLOSED_ISSUES, self._in_sources(CONTAINS, rows, open_)),
+
+            (ASSIGNABLE_PREFIX, self._in_degree(ASSIGNABLE, rows)),
+            (ASSIGNABLE_PREFIX + BIO, zeros),
+            (ASSIGNABLE_PREFIX + COMPANY, zeros),
+
+            (STARGAZER_PREFIX, self._in_degree(STARGAZER, rows)),
+            (STARGAZER_PREFIX + BIO, zeros),
+            (STARGAZER_PREFIX + COMPANY, zeros),
+
+            (MILESTONE, self._any_in_sources(rows, is_label[MILESTONE])),
+            (MILESTONE + UNDERSCORE + CLOSED, self._any_in_sources(rows, is_label[MILESTONE] & closed)),
+
+            (RELEASE + UNDERSCORE, self._any_in_sources(rows, is_label[RELEASE])),
+            (RELEASE + UNDERSCORE + IS_DRAFT,
+             self._any_in_sources(rows, is_label[RELEASE] & _flag(snapshot.column(IS_DRAFT), True))),
+            (RELEASE + UNDERSCORE + IS_PRERELEASE,
+             self._any_in_sources(rows, is_label[RELEASE] & _flag(snapshot.column(IS_PRERELEASE), True))),
+
+            (CONTRIBUTED_TO, self._out_degree(CONTRIBUTED_TO, rows)),
+            (CONTRIBUTED_TO + UNDERSCORE + BIO, contributors_sum(bio)),
+            (CONTRIBUTED_TO + UNDERSCORE + COMPANY, contributors_sum(company)),
+            (CONTRIBUTED_TO + UNDERSCORE + CREATED, contributors_sum(snapshot.degrees(CREATED, IN))),
+            (CONTRIBUTED_TO + UNDERSCORE + FOLLOWS, contributors_sum(snapshot.degrees(FOLLOWS, IN))),
+            (CONTRIBUTED_TO + UNDERSCORE + WROTE, contributors_sum(snapshot.degrees(WROTE, IN))),
+            (CONTRIBUTED_TO + UNDERSCORE + WATCHES, contributors_sum(snapshot.degrees(WATCHES, IN))),
+        ]
+
+    def shares(self, rows, vocabulary: Vocabulary):
+        """Language shares of the given repository vertex indices as a CSR matrix over `vocabulary`."""
+        offsets, languages, sizes = self.snapshot.adjacency(USES, IN)
+        starts, ends = offsets[rows], offsets[rows + 1]
+        lengths = ends - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+
+        # edge positions of all rows back to back, the CSR segment of a row being a contiguous range
+        edges = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - starts, lengths)
+        vertices, inverse = np.unique(languages[edges], return_inverse=True)
+        columns = vocabulary.indices(self.snapshot.column(NAME)[vertices].tolist())[inverse]
+
+        totals = np.repeat(_segment_sums(offsets, sizes, rows), lengths)
+        data = np.divide(sizes[edges], totals, out=np.zeros(len(edges)), where=totals > 0)
+        return sparse.csr_matrix((data, columns, indptr), shape=(len(rows), len(vocabulary)))
+
+    def frame(self, rows):
+        """Feature frame of the given repository vertex indices, with the same columns as `Stats` rows."""
+        properties = self.snapshot.repositories.reindex(rows).dropna(axis=1, how='all')
+        counts = self._counts(rows)
+
+        buffer = ColumnBuffer(properties.columns)
+        for n, row_properties in enumerate(properties.to_dict('records')):
+            row = {key: value for key, value in row_properties.items() if value is not None and not pd.isna(value)}
+            row.update((label, int(values[n])) for label, values in counts)
+            buffer.append(row)
+        return buffer.to_frame()
+
+    def create_train_set(self, writer, quiet=False, chunk_size=CHUNK_SIZE):
+        repositories = self.repositories()
+        for start in tqdm(range(0, len(repositories), chunk_size), unit='chunk', disable=quiet):
+            rows = repositories[start:start + chunk_size]
+            writer.write(self.frame(rows), self.shares(rows, writer.vocabulary))
+        writer.close()
@@ -0,0 +1,193 @@
+"""Chunked writers of the training set."""
+
+import glob
+import json
+import os
+import shutil
+from subprocess import Popen, PIPE
+
+import pandas as pd
+
+from preparator.languages import VOCABULARY_FILENAME, Vocabulary, load_shares, save_shares, shares_path
+
+HADOOP = "hadoop"
+USER = "user"
+
+CHUNK_SIZE = 10000
+STATE_FILENAME = '_state.json'
+HIGH_WATER_MARK = 'high_water_mark'
+
+
+def read_high_water_mark(path):
+    """Start time of the last export into `path`, None if there was none."""
+    try:
+        with open(os.path.join(path, STATE_FILENAME)) as file:
+            return json.load(file)[HIGH_WATER_MARK]
+    except FileNotFoundError:
+        return None
+
+
+def write_high_water_mark(path, high_water_mark):
+    with open(os.path.join(path, STATE_FILENAME), 'w') as file:
+        json.dump({HIGH_WATER_MARK: high_water_mark}, file)
+
+
+class HdfsUploader:
+    """Puts written files into the user's HDFS home directory."""
+
+    def __init__(self, username):
+        super().__init__()
+        self.username = username
+        self._directories = set()
+
+    def _run(self, *args):
+        process = Popen([HADOOP, "fs"] + list(args), stdin=PIPE, bufsize=-1)
+        process.communicate()
+        if process.returncode:
+            raise RuntimeError('hadoop fs {} failed with exit code {}.'.format(args[0], process.returncode))
+
+    def upload(self, path, name):
+        hdfs_path = os.path.join(os.sep, USER, self.username, name)
+        directory = os.path.dirname(hdfs_path)
+        if directory not in self._directories:
+            self._run("-mkdir", "-p", directory)
+            self._directories.add(directory)
+        self._run("-put", "-f", path, hdfs_path)
+
+
+class LocalUploader:
+    """Copies written files into a local directory, a stand-in for HDFS."""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def upload(self, path, name):
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+
+
+class ChunkWriter:
+    """Writes every chunk of rows as a separate part file of the `path` directory and uploads it right away.
+
+    A crash loses at most the chunk being built. Language shares of a part go into a sparse matrix next to it,
+    with columns from the `vocabulary` of the whole export, so parts have the same columns whatever languages
+    their repositories use. Unless `append` is set, parts of a previous export are removed.
+    """
+
+    extension = None
+
+    def __init__(self, path, uploader=None, append=False):
+        super().__init__()
+        self.path = path
+        self.uploader = uploader
+        os.makedirs(path, exist_ok=True)
+
+        parts = self._parts()
+        vocabulary_path = os.path.join(path, VOCABULARY_FILENAME)
+        if append:
+            self.parts = len(parts) and int(os.path.basename(parts[-1])[5:10]) + 1
+            self.vocabulary = Vocabulary.load(vocabulary_path)
+        else:
+            for part in parts:
+                os.remove(part)
+                if os.path.exists(shares_path(part)):
+                    os.remove(shares_path(part))
+            self.parts = 0
+            self.vocabulary = Vocabulary()
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.{}'.format(self.extension))))
+
+    def _read(self, path, columns=None):
+        raise NotImplementedError()
+
+    def _write(self, frame, path):
+        raise NotImplementedError()
+
+    def _upload(self, path):
+        if self.uploader is not None:
+            name = os.path.basename(path)
+            self.uploader.upload(path, os.path.join(os.path.basename(os.path.normpath(self.path)), name))
+
+    def _write_shares(self, shares, path):
+        save_shares(shares_path(path), shares)
+        self._upload(shares_path(path))
+        # the vocabulary only grows, so saving it after the part keeps every written part readable
+        self.vocabulary.save(os.path.join(self.path, VOCABULARY_FILENAME))
+        self._upload(os.path.join(self.path, VOCABULARY_FILENAME))
+
+    def write(self, frame, shares=None):
+        """Writes `frame` as a new part, with the `shares` matrix of its languages if given."""
+        path = os.path.join(self.path, 'part-{:05d}.{}'.format(self.parts, self.extension))
+        self._write(frame, path)
+        self.parts += 1
+        self._upload(path)
+        if shares is not None:
+            self._write_shares(shares, path)
+        return path
+
+    def drop(self, column, values):
+        """Removes rows whose `column` is in `values` from the parts written so far, with their language shares."""
+        values = set(values)
+        for path in self._parts():
+            if not self._read(path, [column])[column].isin(values).any():
+                continue
+            frame = self._read(path)
+            keep = ~frame[column].isin(values).to_numpy()
+            self._write(frame[keep], path)
+            self._upload(path)
+            if os.path.exists(shares_path(path)):
+                self._write_shares(load_shares(shares_path(path))[keep], path)
+
+    def close(self):
+        pass
+
+
+class ParquetWriter(ChunkWriter):
+    extension = 'parquet'
+
+    def _read(self, path, columns=None):
+        return pd.read_parquet(path, columns=columns)
+
+    def _write(self, frame, path):
+        # columns without any value in this chunk have no type, they are absent from the part instead
+        if len(frame):
+            frame = frame.dropna(axis=1, how='all')
+        frame.to_parquet(path, index=False, row_group_size=max(len(frame), 1))
+
+
+class CsvWriter(ChunkWriter):
+    extension = 'csv'
+
+    def _read(self, path, columns=None):
+        return pd.read_csv(path, usecols=columns)
+
+    def _write(self, frame, path):
+        frame.to_csv(path, index=False)
+
+
+def read_parts(path, columns=None):
+    """Yields every part of the export in `path` as a frame and the matrix of its language shares.
+
+    Matrices are padded to the vocabulary saved into `VOCABULARY_FILENAME` of the export, so they all have the
+    same columns. Parts written without shares get None.
+    """
+    vocabulary = Vocabulary.load(os.path.join(path, VOCABULARY_FILENAME))
+    parts = sorted(glob.glob(os.path.join(path, 'part-*.*')))
+    for part in parts:
+        if part.endswith('.' + ParquetWriter.extension):
+            frame = pd.read_parquet(part, columns=columns)
+        elif part.endswith('.' + CsvWriter.extension):
+            frame = pd.read_csv(part, usecols=columns)
+        else:
+            continue
+        shares = load_shares(shares_path(part), len(vocabulary)) if os.path.exists(shares_path(part)) else None
+        yield frame, shares
+
+
+WRITERS = {
+    'parquet': ParquetWriter,
+    'csv': CsvWriter,
+}
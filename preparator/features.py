@@ -0,0 +1,226 @@
+"""Training features of exported repositories, the steps of `data_extraction.ipynb` as one vectorized pass."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from preparator.export import CHUNK_SIZE, read_parts
+from preparator.languages import VOCABULARY_FILENAME, Vocabulary, dense, feature_matrix, language_counts, \
+    top_languages, usage
+from preparator.stats import ASSIGNABLE_PREFIX, BIO, CLOSED, COMPANY, CONTRIBUTED_TO, CREATED, FOLLOWS, IS_DRAFT, \
+    IS_PRERELEASE, MILESTONE, NAME, RELEASE, STARGAZER_PREFIX, TIME_CREATED, TIME_PROCESSED, UNCLOSED_ISSUES, \
+    UNDERSCORE, URI, WATCHES, WROTE
+
+# the export the notebook labelled was crawled on May 14th 2019
+MAY_14TH = 1557850923.935756
+ACTIVE_DAYS = 90
+DAY = 60 * 60 * 24
+
+LABEL = 'label'
+CREATED_AT = 'createdAt'
+PUSHED_AT = 'pushedAt'
+DESCRIPTION = 'description'
+DISK_USAGE = 'diskUsage'
+FORK_COUNT = 'forkCount'
+SQUASH_MERGE_ALLOWED = 'squashMergeAllowed'
+IS_ARCHIVED = 'isArchived'
+IS_FORK = 'isFork'
+
+LANGUAGE_COUNTER = 'languageCounter'
+POPULAR_LANGUAGE_COUNTER = 'popularLanguageCounter'
+HAS_LANGUAGE = 'hasLanguage'
+DESCRIPTION_LEN = 'description_len'
+HAS_DESCRIPTION = 'has_description'
+HAS_ISSUE = 'has_issue'
+STARGAZER_NON_ZERO = 'stargazer_non_zero'
+HAS_MILESTONE = 'has_milestone'
+HAS_RELEASE = 'has_release'
+CONTRIBUTED = 'contributed'
+
+POPULAR_LANGUAGES = ['C', 'Shell', 'C++', 'Ruby', 'Makefile', 'Python', 'JavaScript', 'HTML', 'CSS', 'Java']
+
+CONTRIBUTED_COLUMNS = [CONTRIBUTED_TO] + [CONTRIBUTED_TO + UNDERSCORE + name
+                                          for name in (BIO, COMPANY, CREATED, FOLLOWS, WROTE, WATCHES)]
+
+# every exported column which is not the share of a language
+NON_LANGUAGE_COLUMNS = {
+    'Unnamed: 0', NAME, DESCRIPTION, CREATED_AT, DISK_USAGE, FORK_COUNT, SQUASH_MERGE_ALLOWED, PUSHED_AT,
+    IS_ARCHIVED, 'isDisabled', IS_FORK, 'isLocked', 'isMirror', 'isPrivate', 'url', URI, TIME_CREATED,
+    TIME_PROCESSED, UNCLOSED_ISSUES, ASSIGNABLE_PREFIX, ASSIGNABLE_PREFIX + BIO, ASSIGNABLE_PREFIX + COMPANY,
+    STARGAZER_PREFIX, STARGAZER_PREFIX + BIO, STARGAZER_PREFIX + COMPANY, MILESTONE, MILESTONE + UNDERSCORE + CLOSED,
+    RELEASE + UNDERSCORE, RELEASE + UNDERSCORE + IS_DRAFT, RELEASE + UNDERSCORE + IS_PRERELEASE,
+} | set(CONTRIBUTED_COLUMNS)
+
+# flags which `data.csv` codes 1 for false, as the notebook numbered values in order of appearance
+DATA_CSV_INVERTED_FLAGS = [SQUASH_MERGE_ALLOWED, HAS_LANGUAGE, HAS_DESCRIPTION, STARGAZER_NON_ZERO]
+
+# columns of `data.csv` in its order
+COLUMNS = [LABEL, DISK_USAGE, FORK_COUNT, SQUASH_MERGE_ALLOWED, IS_ARCHIVED, IS_FORK, 'C', 'Shell', 'C++',
+           ASSIGNABLE_PREFIX, STARGAZER_PREFIX, MILESTONE, 'Ruby', 'Makefile', 'Python', 'JavaScript', 'HTML', 'CSS',
+           'Java', LANGUAGE_COUNTER, POPULAR_LANGUAGE_COUNTER, HAS_LANGUAGE, DESCRIPTION_LEN, HAS_DESCRIPTION,
+           HAS_ISSUE, STARGAZER_NON_ZERO, HAS_MILESTONE, HAS_RELEASE, CONTRIBUTED]
+
+def language_columns(columns):
+    return [column for column in columns if column not in NON_LANGUAGE_COLUMNS]
+
+
+def _seconds(column):
+    """Seconds since the epoch of ISO timestamps, parsed once."""
+    timestamps = pd.to_datetime(column, utc=True, errors='coerce')
+    return (timestamps - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+
+
+def _numbers(frame, column):
+    if column not in frame:
+        return np.zeros(len(frame))
+    return pd.to_numeric(frame[column], errors='coerce').fillna(0.0).to_numpy()
+
+
+def _flag(values):
+    return np.asarray(values, dtype=np.int8)
+
+
+def transform(frame, reference_time=MAY_14TH, sparse=True, shares=None, vocabulary=None, popular=None):
+    """Features and label of a chunk of exported repositories, with the columns of `data.csv`.
+
+    Repositories never pushed to are dropped and pushes before the creation count as made at creation, like forks
+    which keep the push time of their origin. The label tells whether the last push happened in the `ACTIVE_DAYS`
+    before `reference_time`. Flags are 0/1 integers and shares of the popular languages are sparse unless `sparse`
+    is false.
+
+    Languages are read from the `shares` matrix over `vocabulary` of the chunk if given, else from the language
+    columns of a wide export. Only the `popular` languages, `POPULAR_LANGUAGES` by default, get dense columns.
+    """
+    popular = POPULAR_LANGUAGES if popular is None else list(popular)
+    created = _seconds(frame[CREATED_AT])
+    pushed = _seconds(frame[PUSHED_AT])
+    pushed_mask = ~np.isnan(pushed)
+    frame, created, pushed = frame[pushed_mask], created[pushed_mask], pushed[pushed_mask]
+    pushed = np.where(pushed < created, created, pushed)
+
+    if shares is not None:
+        shares = shares[np.flatnonzero(pushed_mask)]
+        counts = language_counts(shares)
+        popular_shares = dense(shares, vocabulary, popular, frame.index)
+        known = [vocabulary.index(name) for name in popular if name in vocabulary]
+        popular_counts = language_counts(shares[:, [column for column in known if column < shares.shape[1]]])
+    else:
+        languages = language_columns(frame.columns)
+        counts = frame[languages].notna().sum(axis=1).to_numpy() if languages else np.zeros(len(frame))
+        present = [language for language in popular if language in frame]
+        popular_counts = frame[present].notna().sum(axis=1).to_numpy() if present else np.zeros(len(frame))
+        popular_shares = pd.DataFrame({language: _numbers(frame, language) for language in popular},
+                                      index=frame.index)
+
+    # missing descriptions are 'nan' of length 3, as the notebook measured them
+    description_len = frame[DESCRIPTION].fillna('nan').astype(str).str.len().to_numpy() if DESCRIPTION in frame \
+        else np.full(len(frame), 3)
+    contributed = np.max([_numbers(frame, column) for column in CONTRIBUTED_COLUMNS], axis=0)
+
+    columns = {
+        LABEL: _flag((reference_time - pushed) / DAY < ACTIVE_DAYS),
+        DISK_USAGE: _numbers(frame, DISK_USAGE),
+        FORK_COUNT: _numbers(frame, FORK_COUNT),
+        SQUASH_MERGE_ALLOWED: _flag(_numbers(frame, SQUASH_MERGE_ALLOWED) > 0),
+        IS_ARCHIVED: _flag(_numbers(frame, IS_ARCHIVED) > 0),
+        IS_FORK: _flag(_numbers(frame, IS_FORK) > 0),
+        ASSIGNABLE_PREFIX: _numbers(frame, ASSIGNABLE_PREFIX),
+        STARGAZER_PREFIX: _numbers(frame, STARGAZER_PREFIX),
+        MILESTONE: _numbers(frame, MILESTONE),
+        LANGUAGE_COUNTER: counts,
+        POPULAR_LANGUAGE_COUNTER: popular_counts,
+        HAS_LANGUAGE: _flag(counts > 0),
+        DESCRIPTION_LEN: description_len,
+        HAS_DESCRIPTION: _flag(description_len > 3),
+        HAS_ISSUE: _flag(_numbers(frame, UNCLOSED_ISSUES) > 0),
+        STARGAZER_NON_ZERO: _flag(_numbers(frame, STARGAZER_PREFIX) > 0),
+        HAS_MILESTONE: _flag(_numbers(frame, MILESTONE + UNDERSCORE + CLOSED) > 0),
+        HAS_RELEASE: _flag(_numbers(frame, RELEASE + UNDERSCORE) > 0),
+        CONTRIBUTED: _flag(contributed > 0),
+    }
+    for language in popular:
+        values = popular_shares[language].to_numpy()
+        columns[language] = pd.arrays.SparseArray(values, fill_value=0.0) if sparse else values
+
+    order = COLUMNS if popular == POPULAR_LANGUAGES else \
+        [column for column in COLUMNS if column not in POPULAR_LANGUAGES] + popular
+    return pd.DataFrame(columns, index=frame.index)[order]
+
+
+def transform_chunks(chunks, reference_time=MAY_14TH, sparse=True):
+    for chunk in chunks:
+        yield transform(chunk, reference_time, sparse)
+
+
+def popular_languages(path, k=len(POPULAR_LANGUAGES)):
+    """The `k` languages used by most repositories of the export in `path`, reading only their shares."""
+    vocabulary = Vocabulary.load(os.path.join(path, VOCABULARY_FILENAME))
+    shares = (shares for _, shares in read_parts(path, [URI]) if shares is not None)
+    return top_languages(usage(shares, len(vocabulary)), vocabulary, k)
+
+
+def _popular(path, popular):
+    if popular is None:
+        return POPULAR_LANGUAGES
+    if isinstance(popular, int):
+        return popular_languages(path, popular)
+    return list(popular)
+
+
+def transform_parts(path, reference_time=MAY_14TH, sparse=True, popular=None):
+    """Yields features of every part of the export in `path` with the language shares of their rows.
+
+    Shares keep all languages of the vocabulary as a CSR matrix, for models taking sparse input, while the features
+    only have dense columns of the `popular` languages, the `popular_languages` of the export if it is a number.
+    """
+    popular = _popular(path, popular)
+    vocabulary = Vocabulary.load(os.path.join(path, VOCABULARY_FILENAME))
+    for frame, shares in read_parts(path):
+        # positions of the rows kept by `transform` are their index
+        features = transform(frame.reset_index(drop=True), reference_time, sparse, shares, vocabulary, popular)
+        yield features, None if shares is None else shares[features.index.to_numpy()]
+
+
+def training_set(path, reference_time=MAY_14TH, popular=None):
+    """Features of the export in `path` as a CSR matrix with all languages, labels and names of the columns.
+
+    Repositories use a handful of the languages, so the matrix takes memory per language used and not per language
+    known, and can be passed to models like `XGBClassifier` as it is. `popular` are languages as for
+    `transform_parts`, pass the same ones to `scoring.save_model`.
+    """
+    popular = _popular(path, popular)
+    vocabulary = Vocabulary.load(os.path.join(path, VOCABULARY_FILENAME))
+    matrices, labels, names = [], [], []
+    for features, shares in transform_parts(path, reference_time, sparse=False, popular=popular):
+        if shares is None:
+            shares = scipy.sparse.csr_matrix((len(features), len(vocabulary)))
+        # the dense shares of the popular languages are among the columns of all languages already
+        matrix, names = feature_matrix(features.drop(columns=[LABEL] + popular), shares, vocabulary)
+        matrices.append(matrix)
+        labels.append(features[LABEL].to_numpy())
+    if not matrices:
+        return scipy.sparse.csr_matrix((0, 0)), np.zeros(0, dtype=np.int8), []
+    return scipy.sparse.vstack(matrices, format='csr'), np.concatenate(labels), names
+
+
+def mostly_nan_columns(chunks, threshold):
+    """Columns which are NaN in at least `threshold` of the rows, counted over all chunks."""
+    nans = None
+    rows = 0
+    for chunk in chunks:
+        counts = chunk.isna().sum()
+        nans = counts if nans is None else nans.add(counts, fill_value=0)
+        rows += len(chunk)
+    if nans is None:
+        return []
+    return nans[nans >= threshold * rows].index.tolist()
+
+
+def transform_csv(path, output, chunk_size=CHUNK_SIZE, reference_time=MAY_14TH):
+    """Builds `output` CSV like `data.csv` from an exported CSV at `path` reading `chunk_size` rows at a time."""
+    header = True
+    for features in transform_chunks(pd.read_csv(path, chunksize=chunk_size), reference_time, sparse=False):
+        features.to_csv(output, mode='w' if header else 'a', header=header, index=False)
+        header = False
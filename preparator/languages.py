@@ -0,0 +1,151 @@
+"""Shares of the languages of repositories as sparse matrices over a vocabulary of language names."""
+
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+VOCABULARY_FILENAME = 'languages.json'
+SHARES_EXTENSION = 'languages.npz'
+LANGUAGE_PREFIX = 'language_'
+
+
+class Vocabulary:
+    """Column of every language name in order of appearance.
+
+    Names are only ever appended, so matrices built with an older, shorter vocabulary stay valid and only need
+    padding with empty columns.
+    """
+
+    def __init__(self, names=()):
+        super().__init__()
+        self.names = []
+        self._columns = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.index(name)
+
+    @classmethod
+    def load(cls, path):
+        """Vocabulary saved into `path`, an empty one if there is none."""
+        try:
+            with open(path) as file:
+                return cls(json.load(file))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(list(self.names), file)
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def index(self, name):
+        """Column of `name`, added at the end if it is new."""
+        column = self._columns.get(name)
+        if column is None:
+            with self._lock:
+                column = self._columns.setdefault(name, len(self.names))
+                if column == len(self.names):
+                    self.names.append(name)
+        return column
+
+    def indices(self, names):
+        return np.fromiter((self.index(name) for name in names), dtype=np.int32, count=len(names))
+
+
+def normalize(sizes):
+    """Shares of `sizes` in their sum, zeros if they sum to zero."""
+    sizes = np.asarray(sizes, dtype=np.float64)
+    total = sizes.sum()
+    return sizes / total if total > 0 else np.zeros(len(sizes))
+
+
+class SharesBuffer:
+    """Accumulates language shares of rows as CSR arrays.
+
+    A repository using a language of size zero keeps an explicit zero, so `language_counts` still counts it.
+    """
+
+    def __init__(self, vocabulary):
+        super().__init__()
+        self.vocabulary = vocabulary
+        self.indptr = [0]
+        self.indices = []
+        self.data = []
+
+    def append(self, names, sizes):
+        self.indices.extend(self.vocabulary.indices(names).tolist())
+        self.data.extend(normalize(sizes).tolist())
+        self.indptr.append(len(self.indices))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def to_matrix(self):
+        return sparse.csr_matrix((np.asarray(self.data, dtype=np.float64), np.asarray(self.indices, dtype=np.int32),
+                                  np.asarray(self.indptr, dtype=np.int64)), shape=(len(self), len(self.vocabulary)))
+
+
+def pad(matrix, columns):
+    """`matrix` with empty columns appended up to `columns`, for matrices of an older vocabulary."""
+    if matrix.shape[1] >= columns:
+        return matrix
+    return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], columns))
+
+
+def save_shares(path, matrix):
+    sparse.save_npz(path, sparse.csr_matrix(matrix), compressed=True)
+
+
+def load_shares(path, columns=0):
+    return pad(sparse.load_npz(path).tocsr(), columns)
+
+
+def shares_path(part_path):
+    """Path of the language shares of the part file `part_path`."""
+    return os.path.splitext(part_path)[0] + '.' + SHARES_EXTENSION
+
+
+def language_counts(matrix):
+    """Number of languages of every row."""
+    return np.diff(matrix.indptr)
+
+
+def usage(matrices, columns):
+    """Number of rows using every language, counted over all `matrices`."""
+    counts = np.zeros(columns, dtype=np.int64)
+    for matrix in matrices:
+        counts[:matrix.shape[1]] += np.bincount(matrix.indices, minlength=matrix.shape[1])
+    return counts
+
+
+def top_languages(counts, vocabulary, k):
+    """Names of the `k` languages used by most rows, given their `usage` counts."""
+    order = np.argsort(-counts, kind='stable')[:k]
+    return [vocabulary.names[column] for column in order if counts[column] > 0]
+
+
+def dense(matrix, vocabulary, names, index=None):
+    """Dense frame of the shares of the languages `names`, zero for languages outside the vocabulary."""
+    positions = [n for n, name in enumerate(names) if name in vocabulary and vocabulary.index(name) < matrix.shape[1]]
+    values = np.zeros((matrix.shape[0], len(names)))
+    if positions:
+        values[:, positions] = matrix[:, [vocabulary.index(names[n]) for n in positions]].toarray()
+    return pd.DataFrame(values, index=index, columns=list(names))
+
+
+def feature_matrix(features, shares, vocabulary):
+    """CSR matrix of the numeric `features` followed by all language `shares`, and the names of its columns."""
+    shares = pad(shares, len(vocabulary))
+    matrix = sparse.hstack([sparse.csr_matrix(features.to_numpy(dtype=np.float64)), shares], format='csr')
+    return matrix, list(features.columns) + [LANGUAGE_PREFIX + name for name in vocabulary.names]
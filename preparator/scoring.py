@@ -0,0 +1,177 @@
+"""Batch scoring of repositories with a trained model of their liveness."""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import xgboost
+
+from preparator.export import read_parts
+from preparator.features import CREATED_AT, LABEL, POPULAR_LANGUAGES, PUSHED_AT, language_columns, transform
+from preparator.languages import LANGUAGE_PREFIX, VOCABULARY_FILENAME, SharesBuffer, Vocabulary, pad
+from preparator.stats import ColumnBuffer, BATCH_SIZE, NAME, SIZE, URI
+
+MODEL_FILENAME = 'model.json'
+SCHEMA_FILENAME = 'schema.json'
+COLUMNS = 'columns'
+POPULAR = 'popular'
+INVERTED_FLAGS = 'inverted_flags'
+SPARSE = 'sparse'
+
+SCORE = 'score'
+
+SCORE_BATCH_SIZE = 100000
+
+
+def save_model(model, path, columns, popular=POPULAR_LANGUAGES, inverted_flags=(), sparse=None):
+    """Saves an XGBoost `model` into the `path` directory with the `columns` it was trained on.
+
+    `columns` are names of the feature columns in training order, columns of `features.transform` or languages
+    named `LANGUAGE_PREFIX` + name like the ones of `features.training_set`. `popular` are the languages with
+    dense columns in the features. `inverted_flags` are flags the model saw coded 1 for false, which is
+    `features.DATA_CSV_INVERTED_FLAGS` for models trained on `data.csv`.
+
+    XGBoost takes zeros left out of a sparse matrix for missing values, so `sparse` tells whether the model was
+    trained on sparse matrices, by default if it has the language columns of `features.training_set`.
+    """
+    unknown = set(inverted_flags) - set(columns)
+    if unknown:
+        raise ValueError('Inverted flags {} are not columns of the model.'.format(sorted(unknown)))
+    if sparse is None:
+        sparse = any(column.startswith(LANGUAGE_PREFIX) for column in columns)
+    os.makedirs(path, exist_ok=True)
+    model.save_model(os.path.join(path, MODEL_FILENAME))
+    with open(os.path.join(path, SCHEMA_FILENAME), 'w') as file:
+        json.dump({COLUMNS: list(columns), POPULAR: list(popular), INVERTED_FLAGS: list(inverted_flags),
+                   SPARSE: sparse}, file, indent=1)
+
+
+def _wide_shares(frame):
+    """Shares of the language columns of a wide export and their vocabulary."""
+    languages = language_columns(frame.columns)
+    values = frame[languages].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    rows, columns = np.nonzero(~np.isnan(values))
+    shares = scipy.sparse.csr_matrix((values[rows, columns], (rows, columns)), shape=(len(frame), len(languages)))
+    return shares, Vocabulary(languages)
+
+
+class Scorer:
+    """Scores features of repositories with a saved model, many repositories per prediction.
+
+    Features are built by `features.transform` and laid out as the model's columns, so the model may have been
+    trained on the dense columns of `data.csv`, saved with its inverted flags, or on the sparse matrices of
+    `features.training_set`. Classifiers score the probability of a repository being alive, regressors their
+    prediction. Repositories never pushed to get no score.
+    """
+
+    def __init__(self, booster, columns, popular=POPULAR_LANGUAGES, inverted_flags=(), sparse=False):
+        super().__init__()
+        self.booster = booster
+        self.columns = list(columns)
+        self.popular = list(popular)
+        self.inverted_flags = list(inverted_flags)
+        self.sparse = sparse
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, SCHEMA_FILENAME)) as file:
+            schema = json.load(file)
+        if INVERTED_FLAGS not in schema or SPARSE not in schema:
+            # the flags of data.csv are coded the other way round than the ones of `features.transform`
+            raise ValueError('Schema of {} does not tell how its flags are coded or if it takes sparse input, save '
+                             'the model again with `save_model`.'.format(path))
+        booster = xgboost.Booster(model_file=os.path.join(path, MODEL_FILENAME))
+        return cls(booster, schema[COLUMNS], schema[POPULAR], schema[INVERTED_FLAGS], schema[SPARSE])
+
+    def matrix(self, features, shares, vocabulary):
+        """CSR matrix of `features` and `shares` over `vocabulary` with the columns of the model.
+
+        Languages missing from `vocabulary` are used by none of the repositories and get zeros, any other column
+        of the model missing from `features` is an error.
+        """
+        dense = [column for column in self.columns if column in features]
+        missing = [column for column in self.columns
+                   if column not in features and not column.startswith(LANGUAGE_PREFIX)]
+        if missing:
+            raise ValueError('Features lack columns {} of the model.'.format(missing))
+        features = features[dense].copy()
+        for column in self.inverted_flags:
+            features[column] = 1 - features[column]
+        shares = pad(shares, len(vocabulary))
+        blocks = [scipy.sparse.csr_matrix(features.to_numpy(dtype=np.float64)), shares,
+                  scipy.sparse.csr_matrix((len(features), 1))]
+        matrix = scipy.sparse.hstack(blocks, format='csr')
+
+        # every column of the model picks a column of the blocks, the last one being all zeros
+        positions = {column: n for n, column in enumerate(dense)}
+        positions.update((LANGUAGE_PREFIX + name, len(dense) + n) for n, name in enumerate(vocabulary.names))
+        zeros = matrix.shape[1] - 1
+        return matrix[:, [positions.get(column, zeros) for column in self.columns]]
+
+    def predict(self, matrix):
+        if matrix.shape[0] == 0:
+            return np.zeros(0)
+        # models trained on dense features took zeros as values, not as missing
+        data = matrix if self.sparse else matrix.toarray()
+        return self.booster.predict(xgboost.DMatrix(data, feature_names=self.columns))
+
+    def features(self, frame, shares, vocabulary):
+        """URIs of the repositories of `frame` which can be scored and their matrix.
+
+        Without `shares`, languages are the columns of a wide export like `result_v2.csv`.
+        """
+        frame = frame.reset_index(drop=True)
+        # the label is computed as well but the model does not take it
+        features = transform(frame, sparse=False, shares=shares, vocabulary=vocabulary, popular=self.popular)
+        rows = features.index.to_numpy()
+        if shares is None:
+            shares, vocabulary = _wide_shares(frame)
+        return frame[URI].to_numpy()[rows], self.matrix(features.drop(columns=[LABEL]), shares[rows], vocabulary)
+
+    def score(self, chunks, batch_size=SCORE_BATCH_SIZE):
+        """Yields frames of URIs and scores of `(uris, matrix)` chunks, predicting `batch_size` rows at a time."""
+        uris, matrices, rows = [], [], 0
+        for chunk_uris, matrix in chunks:
+            uris.append(chunk_uris)
+            matrices.append(matrix)
+            rows += matrix.shape[0]
+            if rows >= batch_size:
+                yield self._score(uris, matrices)
+                uris, matrices, rows = [], [], 0
+        if rows:
+            yield self._score(uris, matrices)
+
+    def _score(self, uris, matrices):
+        scores = self.predict(scipy.sparse.vstack(matrices, format='csr'))
+        return pd.DataFrame({URI: np.concatenate(uris), SCORE: scores})
+
+    def score_export(self, path, batch_size=SCORE_BATCH_SIZE):
+        """Yields scores of the repositories of the export in `path`, reading one part at a time."""
+        vocabulary = Vocabulary.load(os.path.join(path, VOCABULARY_FILENAME))
+        chunks = (self.features(frame, shares, vocabulary) for frame, shares in read_parts(path))
+        return self.score(chunks, batch_size)
+
+    def score_graph(self, stats, repo_ids, batch_size=SCORE_BATCH_SIZE, query_batch_size=BATCH_SIZE):
+        """Yields scores of the repositories `repo_ids` with features read straight from the graph of `stats`.
+
+        This skips the export, so repositories can be scored as soon as the spider processed them.
+        """
+        vocabulary = Vocabulary()
+
+        def chunks():
+            columns = [URI, CREATED_AT, PUSHED_AT]
+            rows, shares = ColumnBuffer(columns), SharesBuffer(vocabulary)
+            for start in range(0, len(repo_ids), query_batch_size):
+                for row, languages in stats._repository_rows(repo_ids[start:start + query_batch_size]):
+                    rows.append(row)
+                    shares.append([language[NAME] for language in languages],
+                                  [language[SIZE] for language in languages])
+                if len(rows) >= batch_size:
+                    yield self.features(rows.to_frame(), shares.to_matrix(), vocabulary)
+                    rows, shares = ColumnBuffer(columns), SharesBuffer(vocabulary)
+            if len(rows):
+                yield self.features(rows.to_frame(), shares.to_matrix(), vocabulary)
+
+        return self.score(chunks(), batch_size)
@@ -0,0 +1,131 @@
+"""Offline snapshot of the crawled graph."""
+
+import glob
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from gremlin_python.process.graph_traversal import GraphTraversal, __
+from gremlin_python.process.traversal import T
+from tqdm import tqdm
+
+from preparator.csr import CsrGraph, write_graph
+from preparator.export import ParquetWriter
+from preparator.stats import ColumnBuffer, BIO, CLOSED, COMPANY, IS_DRAFT, IS_PRERELEASE, NAME, PROPERTIES, \
+    REPOSITORY, SIZE, TIME_CREATED, TIME_PROCESSED, URI
+
+REPOSITORIES = 'repositories'
+IDS = 'ids.npy'
+
+ID = '_id'
+INDEX = '_index'
+LABEL = '_label'
+SOURCE = 'source'
+TARGET = 'target'
+
+EXPORT_BATCH_SIZE = 1000
+GRAPH_COLUMNS = (NAME, BIO, COMPANY, CLOSED, IS_DRAFT, IS_PRERELEASE, TIME_CREATED, TIME_PROCESSED)
+
+
+def export_snapshot(g: GraphTraversal, path, batch_size=EXPORT_BATCH_SIZE, quiet=False, columns=GRAPH_COLUMNS):
+    """Dumps the graph into `path` as a `CsrGraph` plus the properties of repositories as Parquet parts.
+
+    Vertices are numbered by their position in the sorted vertex ids. Every edge label gets `out` and `in`
+    offsets/targets arrays plus the `size` of its edges, 0 where missing. Only the `columns` properties of the other
+    vertices are kept. Edges are spilled to disk batch by batch, so they are only held in memory while sorted.
+    """
+    os.makedirs(path, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=path) as directory:
+        _export(g, path, EdgeSpill(directory), batch_size, quiet, columns)
+
+
+class EdgeSpill:
+    """Raw files of the vertex indices and sizes of edges of every label, appended to batch by batch."""
+
+    DTYPES = (np.int64, np.int64, np.float64)
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._files = {}
+
+    def _paths(self, label):
+        return [os.path.join(self.directory, '{}.{}'.format(label, name)) for name in (SOURCE, TARGET, SIZE)]
+
+    def append(self, label, sources, targets, sizes):
+        if label not in self._files:
+            self._files[label] = [open(path, 'wb') for path in self._paths(label)]
+        for file, values, dtype in zip(self._files[label], (sources, targets, sizes), self.DTYPES):
+            np.asarray(values, dtype=dtype).tofile(file)
+
+    def arrays(self):
+        """`(sources, targets, sizes)` of every label, memory-mapped from the spilled files."""
+        arrays = {}
+        for label, files in self._files.items():
+            for file in files:
+                file.close()
+            arrays[label] = tuple(np.memmap(path, dtype=dtype, mode='r')
+                                  for path, dtype in zip(self._paths(label), self.DTYPES))
+        return arrays
+
+
+def _export(g, path, spill, batch_size, quiet, columns):
+    ids = np.sort(np.asarray(g.V().id().toList(), dtype=np.int64))
+    writer = ParquetWriter(os.path.join(path, REPOSITORIES))
+    labels = {}
+    vertex_labels = np.zeros(len(ids), dtype=np.int32)
+    uris = [''] * len(ids)
+    graph_columns = {name: ([], []) for name in columns}
+
+    for start in tqdm(range(0, len(ids), batch_size), unit='batch', disable=quiet):
+        batch = ids[start:start + batch_size].tolist()
+
+        rows = ColumnBuffer([ID, INDEX])
+        vertices = g.V(*batch).project(ID, LABEL, PROPERTIES).by(T.id).by(T.label).by(__.valueMap()).toList()
+        for vertex in vertices:
+            index = int(np.searchsorted(ids, vertex[ID]))
+            row = {key: values[0] for key, values in vertex[PROPERTIES].items()}
+            vertex_labels[index] = labels.setdefault(vertex[LABEL], len(labels))
+            uris[index] = row.get(URI, '')
+            for name, (indices, values) in graph_columns.items():
+                if row.get(name) is not None:
+                    indices.append(index)
+                    values.append(row[name])
+            if vertex[LABEL] == REPOSITORY:
+                row.update({ID: vertex[ID], INDEX: index})
+                rows.append(row)
+        if len(rows):
+            writer.write(rows.to_frame())
+
+        edges = {}
+        for edge in g.V(*batch).outE().project(SOURCE, TARGET, LABEL, SIZE)\
+                .by(__.outV().id()).by(__.inV().id()).by(T.label).by(__.coalesce(__.values(SIZE), __.constant(0)))\
+                .toList():
+            edges.setdefault(edge[LABEL], []).append((edge[SOURCE], edge[TARGET], edge[SIZE]))
+        for label, label_edges in edges.items():
+            sources, targets, sizes = (np.asarray(column) for column in zip(*label_edges))
+            spill.append(label, np.searchsorted(ids, sources), np.searchsorted(ids, targets), sizes)
+
+    write_graph(path, uris, sorted(labels, key=labels.get), vertex_labels, spill.arrays(), graph_columns)
+    np.save(os.path.join(path, IDS), ids)
+
+
+class Snapshot(CsrGraph):
+    """Snapshot written by `export_snapshot`, memory-mapped except for the repository properties."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.ids = np.load(os.path.join(path, IDS), mmap_mode='r')
+        self._repositories = None
+
+    @property
+    def repositories(self):
+        """Properties of repository vertices indexed by their vertex index, read on first use."""
+        if self._repositories is None:
+            parts = sorted(glob.glob(os.path.join(self.path, REPOSITORIES, 'part-*.parquet')))
+            frame = pd.concat([pd.read_parquet(part) for part in parts], sort=False) if parts else \
+                pd.DataFrame(columns=[ID, INDEX])
+            self._repositories = frame.set_index(INDEX).drop(columns=[ID])
+        return self._repositories
+
@@ -1,14 +1,13 @@
-import os
-from subprocess import Popen, PIPE
+import threading
+from concurrent import futures
 
 import pandas as pd
-from gremlin_python.process.graph_traversal import GraphTraversal
+from gremlin_python.process.graph_traversal import GraphTraversal, __
 from gremlin_python.process.traversal import P
 from tqdm import tqdm
 
-# hadoop
-HADOOP = "hadoop"
-USER = "user"
+from preparator.export import CHUNK_SIZE
+from preparator.languages import SharesBuffer
 
 # gremlin
 WATCHES = 'watches'
@@ -35,138 +34,184 @@ CLOSED = 'closed'
 CONTAINS = 'contains'
 
 REPOSITORY = 'repository'
+USER_LABEL = 'user'
+ISSUE = 'issue'
+URI = '_uri'
+TIME_CREATED = '_created'
 TIME_PROCESSED = '_processed'
+TIMESTAMP_SLACK = 300.0
 USES = 'uses'
 NAME = 'name'
 SIZE = 'size'
 UNDERSCORE = '_'
+PROPERTIES = '_properties'
+LANGUAGES = '_languages'
 
+BATCH_SIZE = 50
 
-class Stats:
-    def __init__(self, g: GraphTraversal):
-        super().__init__()
-        self.g = g
-        self.df = self._create_main_dataframe()
-
-    def _create_main_dataframe(self):
-        repo_id = self.g.V().has(TIME_PROCESSED, P.gt(0.0)).hasLabel(REPOSITORY).id().next()
-
-        return pd.DataFrame(columns=self.g.V(repo_id).properties().label().toList())
-
-    def create_train_set(self, filename, username, quiet=False):
-        repo_ids = self.g.V().has(TIME_PROCESSED, P.gt(0.0)).hasLabel(REPOSITORY).id().toList()
-
-        print(f"{len(repo_ids)} ids downloaded...")
-
-        for repo_id in tqdm(repo_ids, total=len(repo_ids), unit='repository', disable=quiet):
-            self._create_repository_row(repo_id)
-        self._save(filename, username)
-
-    def _create_repository_row(self, repo_id):
-        added = self._create_basic_df(repo_id)
-
-        added = pd.concat([added,
-                           self._add_language_features(repo_id),
-                           self._add_issue_features(repo_id),
-                           self._add_assignable_features(repo_id),
-                           self._add_stargazer_features(repo_id),
-                           self._add_milestone_features(repo_id),
-                           self._add_release_features(repo_id),
-                           self._add_contributors_features(repo_id)],
-                          axis=1,
-                          sort=False)
-
-        self.df = pd.concat([self.df, added], sort=False)
 
-    def _create_basic_df(self, repo_id):
-        properties = self.g.V(repo_id).properties().toList()
+def _feature_traversals():
+    """Counted features of a repository vertex as (column, traversal) pairs in column order."""
+    return [
+        (UNCLOSED_ISSUES, __.inE().hasLabel(CONTAINS).outV().has(CLOSED, False).count()),
 
-        labels = [p.label for p in properties]
-        values = [p.value for p in properties]
+        (ASSIGNABLE_PREFIX, __.inE().hasLabel(ASSIGNABLE).count()),
+        (ASSIGNABLE_PREFIX + BIO, __.inE().hasLabel(ASSIGNABLE).has(BIO).count()),
+        (ASSIGNABLE_PREFIX + COMPANY, __.inE().hasLabel(ASSIGNABLE).has(COMPANY).count()),
 
-        return pd.DataFrame([values], columns=labels)
+        (STARGAZER_PREFIX, __.inE().hasLabel(STARGAZER).count()),
+        (STARGAZER_PREFIX + BIO, __.inE().hasLabel(STARGAZER).has(BIO).count()),
+        (STARGAZER_PREFIX + COMPANY, __.inE().hasLabel(STARGAZER).has(COMPANY).count()),
 
-    def _add_language_features(self, repo_id):
-        # TODO: convert to map
-        languages = self.g.V(repo_id).inE().hasLabel(USES).outV().path().by(NAME).by(SIZE).by(NAME).toList()
+        (MILESTONE, __.inE().outV().hasLabel(MILESTONE).count()),
+        (MILESTONE + UNDERSCORE + CLOSED, __.inE().outV().hasLabel(MILESTONE).has(CLOSED, True).count()),
 
-        labels = [language[2] for language in languages]
-        sizes = [language[1] for language in languages]
+        (RELEASE + UNDERSCORE, __.inE().outV().hasLabel(RELEASE).count()),
+        (RELEASE + UNDERSCORE + IS_DRAFT, __.inE().outV().hasLabel(RELEASE).has(IS_DRAFT, True).count()),
+        (RELEASE + UNDERSCORE + IS_PRERELEASE, __.inE().outV().hasLabel(RELEASE).has(IS_PRERELEASE, True).count()),
 
-        if sum(sizes) > 0:
-            sizes = [size / sum(sizes) for size in sizes]
-        else:
-            sizes = [0] * len(sizes)
+        (CONTRIBUTED_TO, __.outE().hasLabel(CONTRIBUTED_TO).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + BIO, __.outE().hasLabel(CONTRIBUTED_TO).inV().has(BIO).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + COMPANY, __.outE().hasLabel(CONTRIBUTED_TO).inV().has(COMPANY).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + CREATED,
+         __.outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(CREATED).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + FOLLOWS,
+         __.outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(FOLLOWS).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + WROTE, __.outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(WROTE).count()),
+        (CONTRIBUTED_TO + UNDERSCORE + WATCHES,
+         __.outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(WATCHES).count()),
+    ]
 
-        return pd.DataFrame([sizes], columns=labels)
 
-    def _add_issue_features(self, repo_id):
-        n_of_unclosed_issues = self.g.V(repo_id).inE().hasLabel(CONTAINS).outV().has(CLOSED, False).count().toList()
+class ColumnBuffer:
+    """Accumulates rows column by column, keeping the union of their columns in order of appearance.
 
-        return pd.DataFrame([n_of_unclosed_issues], columns=[UNCLOSED_ISSUES])
+    Every column stores only the rows it has a value for, so appending costs the size of the row and not the
+    number of columns seen so far. Missing values become NaN when the frame is built.
+    """
 
-    def _add_assignable_features(self, repo_id):
-        number = self.g.V(repo_id).inE().hasLabel(ASSIGNABLE).count().next()
-        bio_number = self.g.V(repo_id).inE().hasLabel(ASSIGNABLE).has(BIO).count().next()
-        company_number = self.g.V(repo_id).inE().hasLabel(ASSIGNABLE).has(COMPANY).count().next()
-
-        values = [number, bio_number, company_number]
-        labels = [ASSIGNABLE_PREFIX, ASSIGNABLE_PREFIX + BIO, ASSIGNABLE_PREFIX + COMPANY]
-
-        return pd.DataFrame([values], columns=labels)
-
-    def _add_stargazer_features(self, repo_id):
-        number = self.g.V(repo_id).inE().hasLabel(STARGAZER).count().next()
-        bio_number = self.g.V(repo_id).inE().hasLabel(STARGAZER).has(BIO).count().next()
-        company_number = self.g.V(repo_id).inE().hasLabel(STARGAZER).has(COMPANY).count().next()
-
-        values = [number, bio_number, company_number]
-        labels = [STARGAZER_PREFIX, STARGAZER_PREFIX + BIO, STARGAZER_PREFIX + COMPANY]
-
-        return pd.DataFrame([values], columns=labels)
-
-    def _add_milestone_features(self, repo_id):
-        ms_number = self.g.V(repo_id).inE().outV().hasLabel(MILESTONE).count().next()
-        closed_ms = self.g.V(repo_id).inE().outV().hasLabel(MILESTONE).has(CLOSED, True).count().next()
-
-        values = [ms_number, closed_ms]
-        labels = [MILESTONE, MILESTONE + UNDERSCORE + CLOSED]
+    def __init__(self, columns=()):
+        super().__init__()
+        self.columns = {column: ([], []) for column in columns}
+        self.rows = 0
 
-        return pd.DataFrame([values], columns=labels)
+    def append(self, row):
+        for column, value in row.items():
+            indices, values = self.columns.setdefault(column, ([], []))
+            indices.append(self.rows)
+            values.append(value)
+        self.rows += 1
 
-    def _add_release_features(self, repo_id):
-        release_number = self.g.V(repo_id).inE().outV().hasLabel(RELEASE).count().next()
-        draft_number = self.g.V(repo_id).inE().outV().hasLabel(RELEASE).has(IS_DRAFT, True).count().next()
-        prerelease_number = self.g.V(repo_id).inE().outV().hasLabel(RELEASE).has(IS_PRERELEASE, True).count().next()
+    def __len__(self):
+        return self.rows
 
-        values = [release_number, draft_number, prerelease_number]
-        labels = [RELEASE + UNDERSCORE, RELEASE + UNDERSCORE + IS_DRAFT, RELEASE + UNDERSCORE + IS_PRERELEASE]
+    def to_frame(self):
+        index = pd.RangeIndex(self.rows)
+        return pd.DataFrame({column: pd.Series(values, index=indices, dtype=None if values else object).reindex(index)
+                             for column, (indices, values) in self.columns.items()},
+                            index=index, columns=list(self.columns))
 
-        return pd.DataFrame([values], columns=labels)
 
-    def _add_contributors_features(self, repo_id):
+class Stats:
+    def __init__(self, g: GraphTraversal):
+        super().__init__()
+        self.g = g
 
-        number = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).count().next()
-        bio_number = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().has(BIO).count().next()
-        company_number = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().has(COMPANY).count().next()
-        creations = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(CREATED).count().next()
-        followers = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(FOLLOWS).count().next()
-        wrotes = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(WROTE).count().next()
-        watchers = self.g.V(repo_id).outE().hasLabel(CONTRIBUTED_TO).inV().inE().hasLabel(WATCHES).count().next()
+    def _main_columns(self):
+        repo_id = self.g.V().has(TIME_PROCESSED, P.gt(0.0)).hasLabel(REPOSITORY).id().next()
 
-        values = [number, bio_number, company_number, creations, followers, wrotes, watchers]
-        labels = [CONTRIBUTED_TO,
-                  CONTRIBUTED_TO + UNDERSCORE + BIO,
-                  CONTRIBUTED_TO + UNDERSCORE + COMPANY,
-                  CONTRIBUTED_TO + UNDERSCORE + CREATED,
-                  CONTRIBUTED_TO + UNDERSCORE + FOLLOWS,
-                  CONTRIBUTED_TO + UNDERSCORE + WROTE,
-                  CONTRIBUTED_TO + UNDERSCORE + WATCHES]
+        return self.g.V(repo_id).properties().label().toList()
+
+    def _touched_repositories(self, since):
+        """Ids of processed repositories with features that may have changed after `since`."""
+        # _created and _processed are stored as 32-bit floats, so they are only precise to minutes
+        since = since - TIMESTAMP_SLACK
+
+        repo_ids = set()
+        for key in (TIME_CREATED, TIME_PROCESSED):
+            # the repository itself was processed, so its properties and in-edges were refreshed
+            repo_ids.update(self.g.V().has(key, P.gt(since)).hasLabel(REPOSITORY)
+                            .has(TIME_PROCESSED, P.gt(0.0)).id().toList())
+            # contributors of the repository got new edges or properties
+            repo_ids.update(self.g.V().has(key, P.gt(since)).hasLabel(USER_LABEL).in_(CONTRIBUTED_TO)
+                            .hasLabel(REPOSITORY).has(TIME_PROCESSED, P.gt(0.0)).id().toList())
+            # issues, milestones and releases of the repository changed state
+            repo_ids.update(self.g.V().has(key, P.gt(since)).hasLabel(ISSUE, MILESTONE, RELEASE).out(CONTAINS)
+                            .hasLabel(REPOSITORY).has(TIME_PROCESSED, P.gt(0.0)).id().toList())
+        return list(repo_ids)
+
+    def repositories(self, since=None):
+        """Ids of processed repositories, only the ones touched after `since` if given."""
+        if since is None:
+            return self.g.V().has(TIME_PROCESSED, P.gt(0.0)).hasLabel(REPOSITORY).id().toList()
+        return self._touched_repositories(since)
+
+    def _uris(self, repo_ids, batch_size):
+        uris = []
+        for start in range(0, len(repo_ids), batch_size):
+            uris.extend(self.g.V(*repo_ids[start:start + batch_size]).values(URI).toList())
+        return uris
+
+    def create_train_set(self, writer, quiet=False, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, workers=1,
+                         since=None):
+        """Writes feature rows of processed repositories in chunks, their language shares over `writer.vocabulary`.
+
+        With `since` only repositories touched after that time are recomputed, replacing their rows written by
+        a previous export into the same `writer`.
+        """
+        repo_ids = self.repositories(since)
+        if since is not None:
+            writer.drop(URI, self._uris(repo_ids, batch_size))
 
-        return pd.DataFrame([values], columns=labels)
+        print(f"{len(repo_ids)} ids downloaded...")
 
-    def _save(self, filename, username):
-        self.df.to_csv(filename)
-        hdfs_path = os.path.join(os.sep, USER, username, filename)
-        put = Popen([HADOOP, "fs", "-put", filename, hdfs_path], stdin=PIPE, bufsize=-1)
-        put.communicate()
+        main_columns = self._main_columns()
+        lock = threading.Lock()
+
+        def flush(rows, shares):
+            frame = rows.to_frame()
+            with lock:
+                writer.write(frame, shares.to_matrix())
+
+        with tqdm(total=len(repo_ids), unit='repository', disable=quiet) as progress:
+
+            def extract(shard):
+                rows, shares = ColumnBuffer(main_columns), SharesBuffer(writer.vocabulary)
+                for start in range(0, len(shard), batch_size):
+                    batch = shard[start:start + batch_size]
+                    for row, languages in self._repository_rows(batch):
+                        rows.append(row)
+                        shares.append([language[NAME] for language in languages],
+                                      [language[SIZE] for language in languages])
+                    if len(rows) >= chunk_size:
+                        flush(rows, shares)
+                        rows, shares = ColumnBuffer(main_columns), SharesBuffer(writer.vocabulary)
+                    progress.update(len(batch))
+
+                if len(rows):
+                    flush(rows, shares)
+
+            # every worker extracts its own shard of ids and writes its own chunks
+            shards = [repo_ids[n::workers] for n in range(workers)]
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for f in [executor.submit(extract, shard) for shard in shards]:
+                    f.result()
+
+        writer.close()
+
+    def _repository_rows(self, repo_ids):
+        """Computes rows of the given repositories with their languages in a single round trip."""
+        features = _feature_traversals()
+
+        traversal = self.g.V(*repo_ids).project(PROPERTIES, LANGUAGES, *[label for label, _ in features])\
+            .by(__.valueMap())\
+            .by(__.inE().hasLabel(USES).project(NAME, SIZE).by(__.outV().values(NAME)).by(SIZE).fold())
+        for _, feature in features:
+            traversal = traversal.by(feature)
+
+        return [self._create_row(result, features) for result in traversal.toList()]
+
+    def _create_row(self, result, features):
+        row = {label: values[0] for label, values in result[PROPERTIES].items()}
+        row.update((label, result[label]) for label, _ in features)
+        return row, result[LANGUAGES]
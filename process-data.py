@@ -1,20 +1,50 @@
 import argparse
+import time
 
 from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.structure.graph import Graph
 
-from preparator.stats import Stats
+from preparator.export import WRITERS, CHUNK_SIZE, HdfsUploader, LocalUploader, read_high_water_mark, \
+    write_high_water_mark
+from preparator.engine import Engine
+from preparator.snapshot import Snapshot, export_snapshot
+from preparator.stats import Stats, BATCH_SIZE
 
 DB_URL = 'ws://localhost:8182/gremlin'
-RESULT_FILENAME = './result.csv'
+RESULT_FILENAME = './result'
 MARIA_DEV = 'maria_dev'
 
 
-def main(args):
+def _connect(args):
     graph = Graph()
-    g = graph.traversal().withRemote(DriverRemoteConnection(DB_URL, 'g'))
-    stats = Stats(g)
-    stats.create_train_set(args.o, args.username)
+    return graph.traversal().withRemote(DriverRemoteConnection(DB_URL, 'g', pool_size=max(4, args.workers)))
+
+
+def main(args):
+    if args.export_snapshot is not None:
+        export_snapshot(_connect(args), args.export_snapshot)
+        return
+
+    if args.local_upload is not None:
+        uploader = LocalUploader(args.local_upload)
+    elif args.no_upload:
+        uploader = None
+    else:
+        uploader = HdfsUploader(args.username)
+
+    since = read_high_water_mark(args.o) if args.incremental else None
+    start = time.time()
+
+    writer = WRITERS[args.format](args.o, uploader, append=since is not None)
+
+    if args.snapshot is not None:
+        Engine(Snapshot(args.snapshot)).create_train_set(writer, chunk_size=args.chunk_size)
+        return
+
+    stats = Stats(_connect(args))
+    stats.create_train_set(writer, batch_size=args.batch_size, chunk_size=args.chunk_size, workers=args.workers,
+                           since=since)
+    write_high_water_mark(args.o, start)
 
 
 if __name__ == '__main__':
@@ -22,4 +52,25 @@ if __name__ == '__main__':
     parser.add_argument('--db-url', type=str, default=DB_URL)
     parser.add_argument('--o', type=str, default=RESULT_FILENAME)
     parser.add_argument('--username', type=str, default=MARIA_DEV)
-    main(parser.parse_args())
+    parser.add_argument('--format', choices=sorted(WRITERS), default='parquet')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="Number of rows in every written part file.")
+    parser.add_argument('--no-upload', action='store_true',
+                        help="Keep the part files local instead of putting them into HDFS.")
+    parser.add_argument('--local-upload', type=str, default=None,
+                        help="Copy the part files into this directory instead of HDFS.")
+    parser.add_argument('--export-snapshot', type=str, default=None,
+                        help="Dump the graph into this directory instead of building the training set.")
+    parser.add_argument('--snapshot', type=str, default=None,
+                        help="Build the training set from a graph snapshot instead of querying the database.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only recompute repositories touched since the last export into --o.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of threads extracting features concurrently.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="Number of repositories whose features are fetched by a single traversal.")
+    args = parser.parse_args()
+    if args.incremental and args.snapshot is not None:
+        # a snapshot holds the whole graph, so its training set replaces the export instead of updating it
+        parser.error("--incremental cannot be combined with --snapshot")
+    main(args)
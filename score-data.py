@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Script for scoring the liveness of repositories with a trained model."""
+
+import argparse
+import time
+
+from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
+from gremlin_python.structure.graph import Graph
+
+from preparator.export import WRITERS, read_high_water_mark, write_high_water_mark
+from preparator.scoring import Scorer, SCORE_BATCH_SIZE
+from preparator.stats import Stats, BATCH_SIZE, URI
+
+DB_URL = 'ws://localhost:8182/gremlin'
+SCORES_FILENAME = './scores'
+FOLLOW_INTERVAL = 60.0
+
+
+def _connect(args):
+    graph = Graph()
+    return graph.traversal().withRemote(DriverRemoteConnection(args.db_url, 'g'))
+
+
+def _score_graph(args, scorer, stats, since):
+    """Scores repositories processed after `since`, all of them if it is None, replacing their previous scores."""
+    start = time.time()
+    writer = WRITERS[args.format](args.o, append=since is not None)
+    repo_ids = stats.repositories(since)
+    scored = 0
+    for scores in scorer.score_graph(stats, repo_ids, args.batch_size, args.query_batch_size):
+        if since is not None:
+            writer.drop(URI, scores[URI])
+        writer.write(scores)
+        scored += len(scores)
+    writer.close()
+    write_high_water_mark(args.o, start)
+    print(f"{scored} of {len(repo_ids)} repositories scored")
+
+
+def main(args):
+    scorer = Scorer.load(args.model)
+
+    if args.export is not None:
+        writer = WRITERS[args.format](args.o)
+        for scores in scorer.score_export(args.export, args.batch_size):
+            writer.write(scores)
+        writer.close()
+        return
+
+    stats = Stats(_connect(args))
+    _score_graph(args, scorer, stats, read_high_water_mark(args.o) if args.incremental or args.follow else None)
+    while args.follow:
+        time.sleep(args.interval)
+        _score_graph(args, scorer, stats, read_high_water_mark(args.o))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, required=True,
+                        help="Directory of a model saved by `preparator.scoring.save_model`.")
+    parser.add_argument('--db-url', type=str, default=DB_URL)
+    parser.add_argument('--o', type=str, default=SCORES_FILENAME)
+    parser.add_argument('--format', choices=sorted(WRITERS), default='parquet')
+    parser.add_argument('--export', type=str, default=None,
+                        help="Score the parts of this training set export instead of reading the graph.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only score repositories touched since the last scoring into --o.")
+    parser.add_argument('--follow', action='store_true',
+                        help="Keep scoring repositories as the spider processes them.")
+    parser.add_argument('--interval', type=float, default=FOLLOW_INTERVAL,
+                        help="Seconds between two rounds of --follow.")
+    parser.add_argument('--batch-size', type=int, default=SCORE_BATCH_SIZE,
+                        help="Number of repositories scored by a single prediction.")
+    parser.add_argument('--query-batch-size', type=int, default=BATCH_SIZE,
+                        help="Number of repositories whose features are fetched by a single traversal.")
+    main(parser.parse_args())